@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+数据集导出流程的性能测试
+
+生成随机的标注文件 分别测试读取、解码、绘制标签图、上色及完整转换的耗时
+结果以 Json 格式保存 可以与之前的结果比较 发现性能退化
+
+usage:
+    python benchmark.py [--size 4000x3000] [--shapes 200] [--vertices 32]
+                        [--types polygon=2,rectangle=1,circle=1] [-r 5]
+                        [-o result.json] [--compare old.json]
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import PIL
+import PIL.Image
+import numpy as np
+from tools import saveJsonFile, loadJsonFile, loadJsonInfo, restoreFromImageData, \
+    shapes_to_label, label2rgb, draw_label, _json_to_dataset
+
+
+def parseTypes(text):
+    '''
+    解析形状类型的比例 例如 polygon=2,rectangle=1,circle=1
+    '''
+    types = {}
+    for item in text.split(','):
+        name, _, weight = item.partition('=')
+        if name not in ('polygon', 'rectangle', 'circle'):
+            raise ValueError('unknown shape type: {}'.format(name))
+        types[name] = float(weight or 1)
+    return types
+
+
+def randomShapes(rng, width, height, count, vertices, types, labels=8):
+    '''
+    生成 count 个随机的标注区域
+    多边形的顶点按极角排列 不会自相交
+    '''
+    names = list(types)
+    weights = np.array([types[n] for n in names])
+    shapes = []
+    for shape_type in rng.choice(names, size=count, p=weights / weights.sum()):
+        cx, cy = rng.uniform(0, width), rng.uniform(0, height)
+        r = rng.uniform(0.02, 0.1) * min(width, height)
+        if shape_type == 'polygon':
+            angles = np.sort(rng.uniform(0, 2 * np.pi, vertices))
+            radius = r * rng.uniform(0.5, 1, vertices)
+            points = np.stack([cx + radius * np.cos(angles), cy + radius * np.sin(angles)], 1)
+        elif shape_type == 'rectangle':
+            points = np.array([[cx - r, cy - r / 2], [cx + r, cy + r / 2]])
+        else:
+            points = np.array([[cx, cy], [cx + r, cy]])
+        shapes.append(dict(
+            label='class{}'.format(rng.integers(labels)),
+            points=np.round(points, 2).tolist(),
+            shape_type=str(shape_type),
+        ))
+    return shapes
+
+
+def generateJson(filename, width, height, count, vertices, types, format='JPEG', seed=0):
+    '''
+    生成一个嵌入了随机图像的标注文件
+    图像为平滑的渐变加噪声 压缩后的大小与照片接近
+    '''
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    img = np.stack([x * 255 // max(1, width - 1), y * 255 // max(1, height - 1),
+                    (x + y) * 255 // max(1, width + height - 2)], -1)
+    img = np.clip(img + rng.integers(-20, 21, img.shape), 0, 255).astype(np.uint8)
+    with io.BytesIO() as f:
+        PIL.Image.fromarray(img).save(f, format=format)
+        imageData = f.getvalue()
+    shapes = randomShapes(rng, width, height, count, vertices, types)
+    imagePath = os.path.splitext(os.path.basename(filename))[0] + \
+        ('.jpg' if format == 'JPEG' else '.png')
+    saveJsonFile(filename, shapes, imagePath, imageData, height, width)
+    return filename
+
+
+def timeit(func, repeat):
+    '''
+    执行 repeat 次 返回每次的耗时 (秒)
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def run(args):
+    width, height = (int(v) for v in args.size.lower().split('x'))
+    types = parseTypes(args.types)
+    workdir = tempfile.mkdtemp(prefix='labelit-bench-')
+    try:
+        filename = generateJson(os.path.join(workdir, 'sample.json'), width, height,
+                                args.shapes, args.vertices, types, args.format, args.seed)
+        data = loadJsonInfo(filename, skip=())
+        img = restoreFromImageData(data['imageData'])
+        label_name_to_value = {'_background_': 0}
+        for s in data['shapes']:
+            label_name_to_value.setdefault(s['label'], len(label_name_to_value))
+        captions = ['{}: {}'.format(lv, ln) for ln, lv in label_name_to_value.items()]
+        lbl = shapes_to_label(img.shape, data['shapes'], label_name_to_value)
+
+        benchmarks = [
+            ('loadJsonFile', lambda: list(loadJsonFile(filename))),
+            ('restoreFromImageData', lambda: restoreFromImageData(data['imageData'])),
+            ('shapes_to_label', lambda: shapes_to_label(
+                img.shape, data['shapes'], label_name_to_value)),
+            ('label2rgb', lambda: label2rgb(lbl, img, n_labels=len(label_name_to_value))),
+            ('draw_label', lambda: draw_label(lbl, img, captions)),
+            ('json_to_dataset', lambda: _json_to_dataset(filename, force=True)),
+        ]
+        results = {}
+        for name, func in benchmarks:
+            if args.only and name not in args.only:
+                continue
+            func()     # 预热 排除首次调用时的缓存等开销
+            times = timeit(func, args.repeat)
+            results[name] = dict(
+                min=min(times),
+                median=statistics.median(times),
+                mean=statistics.mean(times),
+                times=times,
+            )
+            print('{:<24}{:>10.4f}s (median of {})'.format(
+                name, results[name]['median'], args.repeat))
+        jsonSize = os.path.getsize(filename)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return dict(
+        params=dict(width=width, height=height, shapes=args.shapes, vertices=args.vertices,
+                    types=types, format=args.format, seed=args.seed, repeat=args.repeat,
+                    jsonSize=jsonSize),
+        environment=dict(
+            python=platform.python_version(),
+            numpy=np.__version__,
+            pillow=PIL.__version__,
+            platform=platform.platform(),
+            processor=platform.processor(),
+            cpus=os.cpu_count(),
+        ),
+        time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+        results=results,
+    )
+
+
+def compare(result, baseline, threshold):
+    '''
+    与之前的结果比较 返回变慢超过 threshold 的测试项
+    '''
+    if baseline['params'] != result['params']:
+        print('warning: parameters differ from the baseline', file=sys.stderr)
+    regressions = []
+    for name, r in result['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = r['median'] / baseline['results'][name]['median']
+        print('{:<24}{:>9.2f}x'.format(name, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the dataset export pipeline')
+    parser.add_argument('--size', default='4000x3000', help='image size WIDTHxHEIGHT')
+    parser.add_argument('--shapes', type=int, default=200, help='number of shapes')
+    parser.add_argument('--vertices', type=int, default=32, help='vertices per polygon')
+    parser.add_argument('--types', default='polygon=2,rectangle=1,circle=1',
+                        help='shape type mix, e.g. polygon=2,rectangle=1,circle=1')
+    parser.add_argument('--format', default='JPEG', choices=('JPEG', 'PNG'),
+                        help='format of the embedded image')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', help='run only the given benchmarks')
+    parser.add_argument('-o', '--output', help='write the results to a json file')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with a previous result file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown ratio reported as regression (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    result = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        if regressions:
+            print('regressions: {}'.format(', '.join(regressions)), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,6 +3,8 @@ from PyQt5.QtGui import QColor, QPixmap, QPainter
 from PyQt5.QtWidgets import QWidget, QApplication
 from tools import *
 from shape import ShapeFactory, highlightMode
+from shape_index import ShapeGrid
+from shape_store import ShapeStore
 from enum import Enum
 
 
@@ -24,19 +26,21 @@ class Canvas(QWidget):
     scrollRequest = pyqtSignal(int, int)
     newShape = pyqtSignal()
     selectionChanged = pyqtSignal(list)
-    shapeMoved = pyqtSignal()
+    shapeMoved = pyqtSignal(list)
     paintingShape = pyqtSignal(bool)
 
     def __init__(self, *args, **kwargs):
         super(Canvas, self).__init__(*args, **kwargs)
 
         self.mode = mode.EDIT
-        self.shapes = []    # 所有标注区域
+        self.store = ShapeStore()   # 所有标注区域 (列式存储)
+        self.shapeIndex = ShapeGrid()   # 标注区域的空间索引 用于鼠标悬浮及选择
         self.current = None  # 正在绘制的图形
         self.selectedShapes = []  # 被选中的标注区域
         self.hoverShape = None  # 鼠标悬浮的标注区域
         self.selectedVertex = None  # 选中的图形顶点
         self.hasMovedShape = False  # 记录有没有发生图形移动操作
+        self.movedShapes = []   # 本次拖动中被移动的图形
         self.drawingLineColor = QColor(0, 0, 255)
         self.prevPoint = QPoint()
         self.offsets = QPoint(), QPoint()
@@ -96,10 +100,28 @@ class Canvas(QWidget):
             return
         self._scale = value
 
+    @property
+    def shapes(self):
+        '''
+        所有标注区域 增删需要通过 store
+        '''
+        return self.store.shapes
+
     def loadPixmap(self, pixmap):
         self.pixmap = pixmap
+        self.rebuildIndex()
         self.repaint()
 
+    def rebuildIndex(self):
+        '''
+        重新建立所有标注区域的空间索引
+        网格大小与图像尺寸成比例 避免大图像中的网格过多
+        '''
+        if self.pixmap:
+            size = max(self.pixmap.width(), self.pixmap.height())
+            self.shapeIndex.cellSize = max(32, size // 128)
+        self.shapeIndex.rebuild(self.shapes, self.store.boundingBoxes())
+
     # @Overrides(QWidget)
     def focusOutEvent(self, QFocusEvent):
         self.restoreCursor()
@@ -180,15 +202,17 @@ class Canvas(QWidget):
             if Qt.LeftButton & QMouseEvent.buttons():
 
                 # 如果选中的是一个顶点
-                if self.selectedVertex:
+                if self.selectedVertex is not None:
                     self.overrideCursor(cursorType.CURSOR_MOVE.value)
                     index, shape = self.selectedVertex, self.hoverShape    # 正在处理的顶点序号 正在处理的图形
                     point = shape[index]    # 找到对应点
                     if outOfPixmap(self.pixmap, pos):
                         pos = intersectionPoint(self.pixmap, point, pos)
                     shape.moveVertexBy(index, pos - point)  # 调整该顶点位置
+                    self.shapeIndex.update(shape)
                     self.repaint()
                     self.hasMovedShape = True
+                    self.movedShapes = [shape]
 
                 # 如果选中的是一个图形
                 elif self.selectedShapes and self.prevPoint:
@@ -205,20 +229,25 @@ class Canvas(QWidget):
                         pos += QPoint(min(0, self.pixmap.width() - o2.x()),
                                       min(0, self.pixmap.height() - o2.y()))
 
+                    # 所有选中的标注区域在 store 中一起平移
+                    offset = pos - self.prevPoint
+                    self.store.translate(self.selectedShapes, (offset.x(), offset.y()))
                     for shape in self.selectedShapes:
-                        shape.moveBy(pos - self.prevPoint)
+                        self.shapeIndex.update(shape)
                     self.prevPoint = pos
                     self.repaint()
                     self.hasMovedShape = True
+                    self.movedShapes = list(self.selectedShapes)
 
             # 鼠标悬浮
             else:
-                for shape in reversed([s for s in self.shapes]):
-                    # 寻找与当前鼠标位置最接近的顶点
-                    index = nearestVertex(
-                        shape, pos, self.scale)
-                    if index:
-                        if self.selectedVertex:
+                # 只检查外接矩形 (扩展顶点的选取范围后) 包含鼠标位置的标注区域
+                candidates = self.shapeIndex.candidates(pos, 10.0 / self.scale)
+                # 一次求出所有候选区域中与当前鼠标位置最接近的顶点
+                vertexShape, index = nearestShapeVertex(candidates, pos, self.scale)
+                for shape in candidates:
+                    if shape is vertexShape:
+                        if self.selectedVertex is not None:
                             self.hoverShape.highlightClear()
                         self.selectedVertex = index
                         self.hoverShape = shape
@@ -231,7 +260,7 @@ class Canvas(QWidget):
                         # 直接退出
                         break
                     elif shape.containsPoint(pos):
-                        if self.selectedVertex:
+                        if self.selectedVertex is not None:
                             self.hoverShape.highlightClear()
                         self.selectedVertex = None
                         self.hoverShape = shape
@@ -270,7 +299,9 @@ class Canvas(QWidget):
         if QMouseEvent.button() == Qt.LeftButton and self.selectedShapes:
             self.overrideCursor(cursorType.CURSOR_GRAB.value)
         if self.hasMovedShape:
-            self.shapeMoved.emit()
+            self.hasMovedShape = False
+            self.shapeMoved.emit(self.movedShapes)
+            self.movedShapes = []
 
     # @Overrides(QWidget)
     def keyPressEvent(self, QKeyEvent):
@@ -311,12 +342,12 @@ class Canvas(QWidget):
         选择包含了传入点坐标的图形
         '''
         self.deSelectShape()
-        if self.selectedVertex:
+        if self.selectedVertex is not None:
             index, shape = self.selectedVertex, self.hoverShape
             shape.selected = True
             shape.highlightVertex(index, highlightMode.MOVE_VERTEX)
         else:
-            for shape in reversed(self.shapes):
+            for shape in self.shapeIndex.candidates(point):
                 if shape.containsPoint(point):
                     self.calculateOffsets(shape, point)
                     self.selectionChanged.emit([shape])
@@ -337,7 +368,8 @@ class Canvas(QWidget):
         deleted_shapes = []
         if self.selectedShapes:
             for shape in self.selectedShapes:
-                self.shapes.remove(shape)
+                self.store.remove(shape)
+                self.shapeIndex.remove(shape)
                 deleted_shapes.append(shape)
             self.selectedShapes = []
             self.update()
@@ -351,7 +383,8 @@ class Canvas(QWidget):
             return
         selectedShapesCopy = [s.copy() for s in self.selectedShapes]
         for i, shape in enumerate(selectedShapesCopy):
-            self.shapes.append(shape)
+            self.store.append(shape)
+            self.shapeIndex.add(shape)
             self.selectedShapes[i].selected = False
             self.selectedShapes[i] = shape
 
@@ -372,7 +405,8 @@ class Canvas(QWidget):
         '''
         assert self.current
         self.current.close()
-        self.shapes.append(self.current)
+        self.store.append(self.current)
+        self.shapeIndex.add(self.current)
         self.current = None
         self.line = None
         self.newShape.emit()
@@ -386,7 +420,8 @@ class Canvas(QWidget):
 
     def undoLastLine(self):
         assert self.shapes
-        self.current = self.shapes.pop()
+        self.current = self.store.pop()
+        self.shapeIndex.remove(self.current)
         self.current.open()
         if not self.line:
             self.line = ShapeFactory.genShape(
@@ -469,36 +504,18 @@ class Canvas(QWidget):
 
     def resetState(self):
         self.pixmap = None
-        self.shapes = []
+        self.store.clear()
+        self.shapeIndex.clear()
         self.update()
 
     def retrieveAndLoadShape(self, shape_info):
-
-        def reformat_shape(s):
-            '''
-            将json格式中的内容转换为shape
-            包括label、构成区域的所有点以及区域形状
-            '''
-            result = []
-
-            # shapes = ((
-            #     s['label'],
-            #     s['points'],
-            #     s.get('shape_type', 'polygon'))
-            # for s in data['shapes']
-
-            for shape in s:
-                label = shape[0]
-                name = shape[2]
-                points = []
-                for point in shape[1]:
-                    x, y = point
-                    points.append(QPointF(x, y))
-                result.append(ShapeFactory.genShape(
-                    name=name, label=label, points=points))
-
-            return result
-
-        # 加载到 canvas 中
-        result = reformat_shape(shape_info)
-        self.shapes = result
+        '''
+        加载 json 中的所有标注区域
+        shape_info 为 (label, points, shape_type) 的序列
+        所有顶点一次性转换到 store 的顶点数组中
+        '''
+        self.store.load(shape_info)
+        # 打开文件时先加载标注区域再加载图像
+        # 此时网格大小未知 由 loadPixmap 建立一次空间索引即可
+        if self.pixmap:
+            self.rebuildIndex()
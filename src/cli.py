@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+
+"""
+Label-it 命令行工具
+不依赖 PyQt5 可以在没有显示器的服务器上批量处理标注文件
+
+usage:
+    python cli.py convert <dir|glob|file> [...] [-j N] [--artifacts label,label_names]
+    python cli.py shard <dir|glob|file> [...] -o <out_dir> [--samples-per-shard N]
+    python cli.py coco <dir|glob|file> [...] -o <annotations.json>
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+from tools import iter_json_to_dataset, exportOptions, scan_label_names, load_label_names, \
+    isDatasetDir, ARTIFACTS, LABEL_FORMATS, NOT_LABEL_FILE
+
+
+def collectJsonFiles(patterns, exclude=()):
+    '''
+    根据目录、通配符或文件名收集所有 Json 文件
+    目录会被递归扫描
+
+    - exclude: 跳过的文件或目录 (导出的输出) 避免再次作为输入
+    '''
+    exclude = [os.path.abspath(e) for e in exclude]
+
+    def excluded(path):
+        path = os.path.abspath(path)
+        return any(path == e or path.startswith(e + os.sep) for e in exclude)
+
+    filenames = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                # 跳过导出的数据集目录 其中的 manifest.json 不是标注文件
+                dirs[:] = [d for d in dirs if not isDatasetDir(os.path.join(root, d))
+                           and not excluded(os.path.join(root, d))]
+                filenames.extend(os.path.join(root, f) for f in files
+                                 if f.lower().endswith('.json')
+                                 and not excluded(os.path.join(root, f)))
+        else:
+            filenames.extend(f for f in glob.glob(pattern, recursive=True)
+                             if not isDatasetDir(os.path.dirname(f)) and not excluded(f))
+    # 去重并保持顺序
+    return list(dict.fromkeys(filenames))
+
+
+def convert(args):
+    filenames = collectJsonFiles(args.inputs)
+    if not filenames:
+        print('no json files found', file=sys.stderr)
+        return 1
+
+    options = dict(labelFormat=args.label_format, compressLevel=args.compress_level,
+                   tileSize=args.tile_size)
+    if args.artifacts:
+        options['artifacts'] = args.artifacts.split(',')
+    start = time.time()
+    try:
+        # 所有文件使用相同的类别编号
+        if args.labels:
+            options['labelNames'] = load_label_names(args.labels)
+        elif args.scan_labels:
+            options['labelNames'] = scan_label_names(filenames, args.jobs)
+            print('{} labels found in {:.2f}s'.format(
+                len(options['labelNames']) - 1, time.time() - start))
+        options = exportOptions(options)
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    success = skipped = ignored = fail = 0
+    for result in iter_json_to_dataset(filenames, args.jobs, options=options, force=args.force):
+        if result is None:
+            continue
+        filename, error, reason = result
+        if error is not None:
+            fail += 1
+            print('failed {}: {}'.format(filename, error), file=sys.stderr)
+        elif reason == NOT_LABEL_FILE:
+            # 导出的 COCO 标注、分片索引等 不计为失败
+            ignored += 1
+            if args.verbose:
+                print('ignored {}: {}'.format(filename, reason))
+        elif reason:
+            skipped += 1
+        else:
+            success += 1
+            if args.verbose:
+                print('converted {}'.format(filename))
+    elapsed = time.time() - start
+
+    print('{} files: {} successed, {} up to date, {} not label files, {} failed '
+          'in {:.2f}s ({:.1f} files/s)'.format(
+              len(filenames), success, skipped, ignored, fail, elapsed,
+              len(filenames) / max(elapsed, 1e-9)))
+    return 1 if fail else 0
+
+
+def shard(args):
+    # 延迟导入 只转换时不需要
+    from shards import iter_export_shards
+
+    # 输出目录中的 index.json 不作为输入
+    filenames = collectJsonFiles(args.inputs, [args.output])
+    if not filenames:
+        print('no json files found', file=sys.stderr)
+        return 1
+
+    options = dict(labelFormat=args.label_format, compressLevel=args.compress_level)
+    start = time.time()
+    try:
+        if args.labels:
+            options['labelNames'] = load_label_names(args.labels)
+        results = iter_export_shards(
+            filenames, args.output, args.samples_per_shard,
+            args.max_shard_size * (1 << 20) if args.max_shard_size else None,
+            options, args.jobs)
+        success = ignored = fail = 0
+        for filename, error, skipped in results:
+            if error is not None:
+                fail += 1
+                print('failed {}: {}'.format(filename, error), file=sys.stderr)
+            elif skipped:
+                ignored += 1
+            else:
+                success += 1
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    elapsed = time.time() - start
+
+    print('{} files: {} packed, {} not label files, {} failed in {:.2f}s ({:.1f} files/s)'.format(
+        len(filenames), success, ignored, fail, elapsed, len(filenames) / max(elapsed, 1e-9)))
+    return 1 if fail else 0
+
+
+def coco(args):
+    # 延迟导入 只转换时不需要
+    from coco import iter_export_coco
+
+    # 之前导出的 COCO 标注不作为输入
+    filenames = collectJsonFiles(args.inputs, [args.output])
+    if not filenames:
+        print('no json files found', file=sys.stderr)
+        return 1
+
+    start = time.time()
+    try:
+        labelNames = load_label_names(args.labels) if args.labels else None
+        success = ignored = fail = 0
+        for filename, error, skipped in iter_export_coco(filenames, args.output, labelNames,
+                                                         args.jobs, not args.uncompressed):
+            if error is not None:
+                fail += 1
+                print('failed {}: {}'.format(filename, error), file=sys.stderr)
+            elif skipped:
+                ignored += 1
+            else:
+                success += 1
+    except (IOError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    elapsed = time.time() - start
+
+    print('{} files: {} exported, {} not label files, {} failed '
+          'in {:.2f}s ({:.1f} files/s)'.format(
+              len(filenames), success, ignored, fail, elapsed,
+              len(filenames) / max(elapsed, 1e-9)))
+    return 1 if fail else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='label-it')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser(
+        'convert', help='convert json files to datasets (img.png, label.png, ...)')
+    p.add_argument('inputs', nargs='+', help='json files, directories or glob patterns')
+    p.add_argument('-j', '--jobs', type=int, default=0,
+                   help='number of worker processes (default: number of CPUs)')
+    p.add_argument('-a', '--artifacts',
+                   help='comma separated files to export: {} (default: all)'.format(
+                       ','.join(ARTIFACTS)))
+    p.add_argument('--label-format', choices=LABEL_FORMATS, default='palette',
+                   help='8-bit palette or int32 label.png (default: palette)')
+    p.add_argument('--compress-level', type=int, default=6, choices=range(10),
+                   metavar='0-9', help='png compression level (default: 6)')
+    group = p.add_mutually_exclusive_group()
+    group.add_argument('--labels', metavar='FILE',
+                       help='use the class ids from a label names file (one label per line)')
+    group.add_argument('--scan-labels', action='store_true',
+                       help='scan all inputs first so that every dataset uses the same class ids')
+    p.add_argument('--tile-size', type=int, metavar='N',
+                   help='rasterize label.png in N x N tiles saved to label_tiles/, '
+                        'memory is bounded by the tile size (for very large images)')
+    p.add_argument('-f', '--force', action='store_true',
+                   help='convert all files even if the outputs are up to date')
+    p.add_argument('-v', '--verbose', action='store_true', help='print every converted file')
+    p.set_defaults(func=convert)
+
+    p = subparsers.add_parser(
+        'shard', help='pack images and label masks into tar shards for training')
+    p.add_argument('inputs', nargs='+', help='json files, directories or glob patterns')
+    p.add_argument('-o', '--output', required=True, help='output directory')
+    p.add_argument('-n', '--samples-per-shard', type=int, default=1000,
+                   help='maximum number of samples in a shard (default: 1000)')
+    p.add_argument('--max-shard-size', type=int, metavar='MB',
+                   help='start a new shard once a shard reaches this size')
+    p.add_argument('-j', '--jobs', type=int, default=0,
+                   help='number of worker processes (default: number of CPUs)')
+    p.add_argument('--labels', metavar='FILE',
+                   help='use the class ids from a label names file '
+                        '(default: scan all inputs for labels)')
+    p.add_argument('--label-format', choices=LABEL_FORMATS, default='palette',
+                   help='8-bit palette or int32 label masks (default: palette)')
+    p.add_argument('--compress-level', type=int, default=6, choices=range(10),
+                   metavar='0-9', help='png compression level (default: 6)')
+    p.set_defaults(func=shard)
+
+    p = subparsers.add_parser(
+        'coco', help='export all shapes as COCO annotations with RLE masks')
+    p.add_argument('inputs', nargs='+', help='json files, directories or glob patterns')
+    p.add_argument('-o', '--output', required=True, help='output COCO json file')
+    p.add_argument('-j', '--jobs', type=int, default=0,
+                   help='number of worker processes (default: number of CPUs)')
+    p.add_argument('--labels', metavar='FILE',
+                   help='use the class ids from a label names file '
+                        '(default: scan all inputs for labels)')
+    p.add_argument('--uncompressed', action='store_true',
+                   help='write RLE counts as lists instead of compressed strings')
+    p.set_defaults(func=coco)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+'''
+导出 COCO 格式的标注
+
+每个标注区域直接在其外接矩形内绘制 再转换为整张图像上的游程编码 (RLE)
+不需要生成与图像等大的掩模
+
+RLE 按列优先的顺序排列像素 counts 依次为 0 与 1 的游程长度 第一个为 0 的长度
+'''
+import os
+import json
+import numpy as np
+import PIL.Image
+import PIL.ImageDraw
+from tools import loadJsonInfo, loadImageArray, resolveImagePath, shape_to_polygon, \
+    draw_shape, scan_label_names, exportOptions, poolMap, isLabelData, BACKGROUND, \
+    NOT_LABEL_FILE
+
+
+def shape_to_rle(shape, height, width):
+    '''
+    将一个标注区域转换为 RLE
+    返回 (counts, bbox, area) bbox 为 [x, y, w, h] 区域完全在图像外时返回 None
+    '''
+    xy, isCircleArea = shape_to_polygon(shape)
+    if not xy:
+        return None
+    # 与 shapes_to_label_tiles 相同 先按 PIL 的方式取整再平移
+    xy = [(int(x), int(y)) for x, y in xy]
+    xs = [p[0] for p in xy]
+    ys = [p[1] for p in xy]
+    x0, x1 = max(0, min(xs)), min(width - 1, max(xs))
+    y0, y1 = max(0, min(ys)), min(height - 1, max(ys))
+    if x0 > x1 or y0 > y1:
+        return None
+
+    # 只在外接矩形内绘制
+    h, w = y1 - y0 + 1, x1 - x0 + 1
+    mask = PIL.Image.new('L', (w, h), 0)
+    draw_shape(PIL.ImageDraw.Draw(mask), [(x - x0, y - y0) for x, y in xy], isCircleArea, 1)
+    mask = np.asarray(mask, dtype=bool)
+    if not mask.any():
+        return None
+
+    # 按列在上下各补一个 0 求出每一列中游程的起止位置
+    padded = np.zeros((w, h + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask.T
+    col, row = np.nonzero(np.diff(padded, axis=1))
+    # 转换为整张图像中按列优先排列的位置
+    bounds = (col + x0) * height + (row + y0)
+    # 游程跨越相邻两列时 前一列的终点与后一列的起点重合 需要合并
+    bounds, repeat = np.unique(bounds, return_counts=True)
+    bounds = bounds[repeat == 1]
+    counts = np.diff(np.concatenate([[0], bounds, [height * width]]))
+
+    rows = np.nonzero(mask.any(axis=1))[0]
+    cols = np.nonzero(mask.any(axis=0))[0]
+    bbox = [int(x0 + cols[0]), int(y0 + rows[0]),
+            int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)]
+    return counts.tolist(), bbox, int(mask.sum())
+
+
+def rle_to_string(counts):
+    '''
+    将 counts 压缩为字符串 与 pycocotools 的压缩格式相同
+    '''
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def _coco_file(args):
+    '''
+    转换一个 Json 文件 在进程池中执行
+    返回 (filename, image, annotations, error)
+    不是标注文件时 image 及 error 均为 None
+    '''
+    filename, outDir, categories, compressed = args
+    try:
+        data = loadJsonInfo(filename)
+        if not isLabelData(data):
+            return filename, None, None, None
+        height, width = data.get('imageHeight'), data.get('imageWidth')
+        if not height or not width:
+            height, width = loadImageArray(filename, loadJsonInfo(filename, skip=())).shape[:2]
+        imagePath = resolveImagePath(filename, data['imagePath'])
+        image = dict(
+            file_name=os.path.relpath(imagePath, outDir).replace(os.sep, '/'),
+            height=height,
+            width=width,
+        )
+        annotations = []
+        for shape in data['shapes']:
+            if shape['label'] not in categories:
+                raise ValueError('label not in label names: {}'.format(shape['label']))
+            rle = shape_to_rle(shape, height, width)
+            if rle is None:
+                continue
+            counts, bbox, area = rle
+            annotations.append(dict(
+                category_id=categories[shape['label']],
+                segmentation=dict(
+                    size=[height, width],
+                    counts=rle_to_string(counts) if compressed else counts,
+                ),
+                area=area,
+                bbox=bbox,
+                iscrowd=0,
+            ))
+    except Exception as e:
+        return filename, None, None, '{}: {}'.format(type(e).__name__, e)
+    return filename, image, annotations, None
+
+
+def iter_export_coco(filenames, output, labelNames=None, workers=None, compressed=True):
+    '''
+    将多个 Json 文件导出为一个 COCO 格式的 Json 文件
+
+    - labelNames: 类别列表 为 None 时先扫描所有文件
+      类别编号与 labelNames 中的序号相同 _background_ 不作为类别
+    - compressed: 是否将 RLE 压缩为字符串
+
+    按 filenames 的顺序依次返回 (filename, error, skipped) 全部完成后写入 output
+    skipped 为 None 或 tools.NOT_LABEL_FILE (不是标注文件 不导出)
+    '''
+    filenames = list(filenames)
+    if labelNames is None:
+        labelNames = scan_label_names(filenames, workers)
+    labelNames = exportOptions(dict(labelNames=labelNames))['labelNames']
+    categories = {name: i for i, name in enumerate(labelNames) if name != BACKGROUND}
+    outDir = os.path.dirname(os.path.abspath(output))
+
+    images, annotations = [], []
+    args = [(f, outDir, categories, compressed) for f in filenames]
+    results = poolMap(_coco_file, args, workers, chunksize=16)
+    try:
+        for filename, image, anns, error in results:
+            if error is None and image is None:
+                yield filename, None, NOT_LABEL_FILE
+                continue
+            if error is None:
+                image['id'] = len(images) + 1
+                images.append(image)
+                for ann in anns:
+                    ann['id'] = len(annotations) + 1
+                    ann['image_id'] = image['id']
+                    annotations.append(ann)
+            yield filename, error, None
+    finally:
+        results.close()
+
+    with open(output, 'w') as f:
+        json.dump(dict(
+            images=images,
+            annotations=annotations,
+            categories=[dict(id=i, name=name) for name, i in categories.items()],
+        ), f, ensure_ascii=False)
@@ -0,0 +1,147 @@
+import os
+import json
+import threading
+
+
+class Journal(object):
+    '''
+    标注文件的追加式修改日志
+
+    与标注文件同名 后缀为 .journal
+    每一行是一条 Json 格式的修改记录 例如:
+        {"seq": 1, "op": "add", "label": "cat", "points": [[0, 0], [1, 1]], "shape_type": "rectangle"}
+        {"seq": 2, "op": "move", "index": 0, "points": [[2, 2], [3, 3]]}
+        {"seq": 3, "op": "relabel", "index": 0, "label": "dog"}
+        {"seq": 4, "op": "delete", "index": 0}
+
+    标注文件中的 journalSeq 字段记录了已经合并进标注文件的最后一条记录
+    重放时只应用序号更大的记录 因此合并过程中程序崩溃也不会重复应用修改
+    '''
+
+    def __init__(self, labelFile):
+        self.labelFile = labelFile
+        self.path = os.path.splitext(labelFile)[0] + '.journal'
+        self.seq = 0    # 最后一条记录的序号
+        self.count = 0  # 尚未合并进标注文件的记录数
+        self.error = None   # 重放时遇到的无法应用的记录
+        self._f = None
+        self._lock = threading.Lock()
+
+    def replay(self, shapes, baseSeq=0):
+        '''
+        将日志中序号大于 baseSeq 的记录应用到 shapes 上
+
+        - shapes: 标注文件中的 shapes 字段 会被直接修改
+        - baseSeq: 标注文件中的 journalSeq 字段
+        遇到无法应用的记录 (例如序号超出范围) 时停止重放
+        丢弃该记录及之后的所有记录 并将原因记录在 error 中
+        '''
+        self.seq = baseSeq
+        self.count = 0
+        self.error = None
+        if not os.path.exists(self.path):
+            return shapes
+
+        valid = 0   # 完整记录的总长度
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    # 写入过程中崩溃 最后一行可能不完整
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                if record['seq'] > baseSeq:
+                    try:
+                        self._apply(shapes, record)
+                    except (KeyError, IndexError, ValueError) as e:
+                        # 日志与标注文件不一致 之后的记录都无法正确应用
+                        self.error = 'journal record {}: {}'.format(record['seq'], e)
+                        break
+                    self.seq = record['seq']
+                    self.count += 1
+                valid += len(line)
+
+        # 截去不完整或无法应用的记录 避免之后的追加内容与其拼接在一起
+        if valid != os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid)
+        return shapes
+
+    @staticmethod
+    def _apply(shapes, record):
+        op = record['op']
+        if op == 'add':
+            shapes.append(dict(
+                label=record['label'],
+                points=record['points'],
+                shape_type=record['shape_type'],
+            ))
+        elif op in ('move', 'relabel', 'delete') and \
+                not 0 <= record['index'] < len(shapes):
+            raise IndexError('shape index {} out of range'.format(record['index']))
+        elif op == 'move':
+            shapes[record['index']]['points'] = record['points']
+        elif op == 'relabel':
+            shapes[record['index']]['label'] = record['label']
+        elif op == 'delete':
+            del shapes[record['index']]
+        else:
+            raise ValueError('Unsupported journal op: %s' % op)
+
+    def append(self, op, **kwargs):
+        '''
+        追加一条记录 写入后立即同步到磁盘
+        '''
+        with self._lock:
+            self.seq += 1
+            self.count += 1
+            record = dict(seq=self.seq, op=op, **kwargs)
+            if self._f is None:
+                self._f = open(self.path, 'ab')
+            self._f.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+            self._f.flush()
+            os.fsync(self._f.fileno())
+
+    def truncate(self, seq):
+        '''
+        丢弃序号不大于 seq 的记录
+        在这些记录已经合并进标注文件后调用 可以在后台线程中执行
+        '''
+        with self._lock:
+            self._close()
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, 'rb') as f:
+                lines = [line for line in f
+                         if json.loads(line.decode('utf-8'))['seq'] > seq]
+            self.count = len(lines)
+            if not lines:
+                os.remove(self.path)
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.writelines(lines)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+
+    def discard(self):
+        '''
+        删除日志文件
+        '''
+        with self._lock:
+            self._close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.count = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
@@ -0,0 +1,184 @@
+'''
+二进制格式的标注文件 (.lbin)
+
+与 Json 格式保存相同的内容 但顶点坐标以连续的 float32 数组存放
+可以通过内存映射直接读取 适合顶点较多的数据集
+
+文件结构 (小端序):
+    header      固定长度的文件头 见 HEADER
+    meta        utf-8 编码的 Json 其余字段 (imagePath, imageHash 等)
+    labels      labelCount 个 uint32 长度 + 依次拼接的 utf-8 标签名
+    shapes      shapeCount 条记录 见 SHAPE_DTYPE
+    vertices    vertexCount x 2 的坐标数组 (float32 或 float64)
+    imageData   图像文件的原始字节 (引用模式下长度为 0)
+各个数据块的起始位置均按 8 字节对齐
+'''
+import os
+import json
+import base64
+import struct
+import tempfile
+import numpy as np
+from tools import saveJsonFile
+
+
+MAGIC = b'LBIN'
+VERSION = 1
+SUFFIX = '.lbin'
+
+# magic, version, coordSize, imageHeight, imageWidth,
+# shapeCount, labelCount, vertexCount, metaLength, imageDataLength
+HEADER = struct.Struct('<4sHHIIIIQIQ')
+
+SHAPE_DTYPE = np.dtype([
+    ('label', '<u4'),   # 标签在 labels 中的序号
+    ('type', '<u4'),    # 形状在 SHAPE_TYPES 中的序号
+    ('offset', '<u8'),  # 第一个顶点在 vertices 中的位置
+    ('count', '<u8'),   # 顶点数
+])
+
+SHAPE_TYPES = ('polygon', 'rectangle', 'circle')
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def saveBinaryFile(filename, shapes, imagePath, imageData, imageHeight, imageWidth,
+                   dtype=np.float32, **extra):
+    '''
+    以二进制格式保存标注结果 参数与 tools.saveJsonFile 相同
+
+    - imageData: 图像文件的原始字节 为 None 时即为引用模式
+    - dtype: 坐标的存储类型 需要与 Json 完全一致时使用 np.float64
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    labels = []
+    labelIds = {}
+    table = np.zeros(len(shapes), dtype=SHAPE_DTYPE)
+    offset = 0
+    for i, s in enumerate(shapes):
+        label = s['label']
+        if label not in labelIds:
+            labelIds[label] = len(labels)
+            labels.append(label)
+        table[i] = (labelIds[label], SHAPE_TYPES.index(s.get('shape_type', 'polygon')),
+                    offset, len(s['points']))
+        offset += len(s['points'])
+    vertices = np.zeros((offset, 2), dtype=dtype)
+    for s, t in zip(shapes, table):
+        if t['count']:
+            vertices[t['offset']:t['offset'] + t['count']] = s['points']
+
+    meta = dict(imagePath=imagePath)
+    meta.update(extra)
+    meta = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+    encoded = [label.encode('utf-8') for label in labels]
+    labelBlock = np.array([len(b) for b in encoded], dtype='<u4').tobytes() + b''.join(encoded)
+    imageData = bytes(imageData) if imageData is not None else b''
+
+    header = HEADER.pack(MAGIC, VERSION, dtype.itemsize, imageHeight, imageWidth,
+                         len(shapes), len(labels), offset, len(meta), len(imageData))
+    blocks = (header, meta, labelBlock, table.tobytes(), vertices.tobytes(), imageData)
+
+    # 与 saveJsonFile 相同 先写入临时文件再替换
+    fd, tmp = tempfile.mkstemp(
+        prefix='.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for block in blocks:
+                f.write(block)
+                f.write(b'\0' * (_align(len(block)) - len(block)))
+        os.chmod(tmp, os.stat(filename).st_mode if os.path.exists(filename) else 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def loadBinaryFile(filename):
+    '''
+    通过内存映射读取二进制标注文件
+
+    返回的字典与 Json 文件的内容类似 另外包括:
+     - labels: 所有标签名
+     - shapeTable: 每个形状的标签序号、类型、顶点位置及顶点数 (SHAPE_DTYPE)
+     - vertices: 所有顶点坐标 Nx2 数组
+    shapes 中每个形状的 points 都是 vertices 的视图 不会复制数据
+    '''
+    buf = np.memmap(filename, dtype=np.uint8, mode='r')
+    (magic, version, coordSize, imageHeight, imageWidth, shapeCount,
+     labelCount, vertexCount, metaLength, imageDataLength) = HEADER.unpack_from(buf, 0)
+    if magic != MAGIC:
+        raise ValueError('not a label binary file: {}'.format(filename))
+    if version > VERSION:
+        raise ValueError('unsupported label binary version: {}'.format(version))
+
+    pos = _align(HEADER.size)
+    data = json.loads(bytes(buf[pos:pos + metaLength]).decode('utf-8'))
+    pos = _align(pos + metaLength)
+
+    lengths = np.frombuffer(buf, dtype='<u4', count=labelCount, offset=pos)
+    start = pos + 4 * labelCount
+    labels = []
+    for n in lengths.tolist():
+        labels.append(bytes(buf[start:start + n]).decode('utf-8'))
+        start += n
+    pos = _align(start)
+
+    table = np.frombuffer(buf, dtype=SHAPE_DTYPE, count=shapeCount, offset=pos)
+    pos = _align(pos + SHAPE_DTYPE.itemsize * shapeCount)
+
+    vertices = np.frombuffer(buf, dtype='<f{}'.format(coordSize),
+                             count=2 * vertexCount, offset=pos).reshape(-1, 2)
+    pos = _align(pos + 2 * coordSize * vertexCount)
+
+    data.update(
+        shapes=[dict(
+            label=labels[label],
+            points=vertices[offset:offset + count],
+            shape_type=SHAPE_TYPES[type],
+        ) for label, type, offset, count in table.tolist()],
+        imageData=buf[pos:pos + imageDataLength] if imageDataLength else None,
+        imageHeight=imageHeight,
+        imageWidth=imageWidth,
+        labels=labels,
+        shapeTable=table,
+        vertices=vertices,
+    )
+    return data
+
+
+def jsonToBinary(jsonFile, binaryFile=None, dtype=np.float32):
+    '''
+    将 Json 标注文件转换为二进制格式
+    嵌入的 base64 图像数据以原始字节保存
+    '''
+    if binaryFile is None:
+        binaryFile = os.path.splitext(jsonFile)[0] + SUFFIX
+    with open(jsonFile, 'r') as f:
+        data = json.load(f)
+    imageData = data.pop('imageData', None)
+    if imageData is not None:
+        imageData = base64.b64decode(imageData)
+    saveBinaryFile(binaryFile, data.pop('shapes'), data.pop('imagePath'), imageData,
+                   data.pop('imageHeight'), data.pop('imageWidth'), dtype=dtype, **data)
+    return binaryFile
+
+
+def binaryToJson(binaryFile, jsonFile=None):
+    '''
+    将二进制标注文件转换回 Json 格式
+    '''
+    if jsonFile is None:
+        jsonFile = os.path.splitext(binaryFile)[0] + '.json'
+    data = loadBinaryFile(binaryFile)
+    shapes = [dict(label=s['label'], points=s['points'].tolist(), shape_type=s['shape_type'])
+              for s in data.pop('shapes')]
+    imageData = data.pop('imageData')
+    for key in ('labels', 'shapeTable', 'vertices'):
+        data.pop(key)
+    saveJsonFile(jsonFile, shapes, data.pop('imagePath'),
+                 bytes(imageData) if imageData is not None else None,
+                 data.pop('imageHeight'), data.pop('imageWidth'), **data)
+    return jsonFile
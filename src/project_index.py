@@ -0,0 +1,219 @@
+import os
+import math
+import hashlib
+import sqlite3
+import threading
+from tools import loadJsonInfo, isLabelData, loadImageBytes, resolveImagePath, hashFile, \
+    poolMap, isDatasetDir
+
+
+INDEX_FILE = '.labelit.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS images (
+    label_file TEXT PRIMARY KEY,    -- 相对于工程目录的标注文件路径
+    image_path TEXT,                -- 相对于工程目录的图像路径
+    width INTEGER,
+    height INTEGER,
+    mtime REAL,                     -- 标注文件的修改时间
+    image_hash TEXT                 -- 图像的 sha1 值 找不到图像时为空
+);
+CREATE TABLE IF NOT EXISTS shapes (
+    label_file TEXT,
+    label TEXT,
+    shape_type TEXT,
+    xmin REAL,
+    ymin REAL,
+    xmax REAL,
+    ymax REAL
+);
+CREATE INDEX IF NOT EXISTS shapes_label ON shapes (label);
+CREATE INDEX IF NOT EXISTS shapes_label_file ON shapes (label_file);
+'''
+
+
+def shapeBoundingBox(points, shape_type):
+    '''
+    计算标注区域的外接矩形 (xmin, ymin, xmax, ymax)
+    '''
+    if shape_type == 'circle':
+        (cx, cy), (px, py) = points[:2]
+        r = math.hypot(px - cx, py - cy)
+        return cx - r, cy - r, cx + r, cy + r
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def imageHash(labelFile, imageFile, data):
+    '''
+    标注文件对应图像的 sha1 值
+    引用模式下直接使用 Json 中记录的 imageHash
+    嵌入模式下嵌入的是原图的字节 与磁盘上的图像文件相同
+    找不到图像文件时使用嵌入的数据 都没有时返回 None
+    '''
+    if data.get('imageHash'):
+        return data['imageHash']
+    if os.path.isfile(imageFile):
+        return hashFile(imageFile)
+    try:
+        return hashlib.sha1(loadImageBytes(labelFile, loadJsonInfo(labelFile, skip=()))).hexdigest()
+    except Exception:
+        return None
+
+
+def _scanLabelFile(args):
+    '''
+    读取一个标注文件 生成索引中的记录
+    在进程池中执行
+    '''
+    dirname, labelFile = args
+    try:
+        data = loadJsonInfo(labelFile)
+        if not isLabelData(data):
+            return None
+        imageFile = resolveImagePath(labelFile, data['imagePath'])
+        return _records(dirname, labelFile, data['shapes'], imageFile,
+                        data.get('imageWidth'), data.get('imageHeight'),
+                        os.path.getmtime(labelFile), imageHash(labelFile, imageFile, data))
+    except Exception:
+        return None
+
+
+def _records(dirname, labelFile, shapes, imageFile, width, height, mtime, imageHash):
+    key = os.path.relpath(labelFile, dirname)
+    image = (key, os.path.relpath(imageFile, dirname), width, height, mtime, imageHash)
+    rows = []
+    for s in shapes:
+        shape_type = s.get('shape_type', 'polygon')
+        if s['points']:
+            bbox = shapeBoundingBox(s['points'], shape_type)
+        else:
+            bbox = (None, None, None, None)
+        rows.append((key, s['label'], shape_type) + tuple(bbox))
+    return image, rows
+
+
+class ProjectIndex(object):
+    '''
+    工程目录下所有标注文件的索引
+
+    保存在工程目录下的 .labelit.db (SQLite) 中
+    记录每个标注文件对应的图像、尺寸、修改时间、图像的哈希值
+    以及其中每个标注区域的标签、形状和外接矩形
+    用于快速地按标签筛选图像及统计标注信息
+    '''
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+        # 保存标注文件时会在后台线程中更新索引
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(dirname, INDEX_FILE),
+                                   check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _write(self, records):
+        with self._lock, self._db:
+            for image, rows in records:
+                self._db.execute('DELETE FROM shapes WHERE label_file = ?', image[:1])
+                self._db.execute('INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?, ?, ?)', image)
+                self._db.executemany('INSERT INTO shapes VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+
+    def update(self, labelFile, shapes, imageFile, width, height, imageHash=None):
+        '''
+        保存标注文件后 更新该文件在索引中的记录
+        shapes 的格式与 Json 文件中的 shapes 字段相同
+        imageHash 为 None 时 (嵌入模式) 计算图像文件的哈希值
+        '''
+        if imageHash is None and os.path.isfile(imageFile):
+            imageHash = hashFile(imageFile)
+        self._write([_records(self.dirname, labelFile, shapes, imageFile, width, height,
+                              os.path.getmtime(labelFile), imageHash)])
+
+    def remove(self, labelFile):
+        key = os.path.relpath(labelFile, self.dirname)
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM shapes WHERE label_file = ?', (key,))
+            self._db.execute('DELETE FROM images WHERE label_file = ?', (key,))
+
+    def rebuild(self, workers=None, full=False, cancel=None):
+        '''
+        扫描工程目录下的所有标注文件 更新索引
+
+        - workers: 进程池大小 默认为 CPU 核心数
+        - full: 为 False 时跳过修改时间未变化且已有图像哈希值的标注文件
+        - cancel: threading.Event 被设置后尽快停止 已经读取的文件仍会写入索引
+        返回重新读取的文件数
+        '''
+        labelFiles = []
+        for root, dirs, files in os.walk(self.dirname):
+            # 跳过导出的数据集目录 其中的 manifest.json 不是标注文件
+            dirs[:] = [d for d in dirs if not isDatasetDir(os.path.join(root, d))]
+            for file in files:
+                if file.lower().endswith('.json'):
+                    labelFiles.append(os.path.join(root, file))
+
+        with self._lock:
+            known = {key: (mtime, h) for key, mtime, h in self._db.execute(
+                'SELECT label_file, mtime, image_hash FROM images')}
+        existing = set(os.path.relpath(f, self.dirname) for f in labelFiles)
+        for key in set(known) - existing:
+            self.remove(os.path.join(self.dirname, key))
+        if not full:
+            # 之前只在引用模式下记录哈希值 缺少哈希值的记录也重新读取
+            def upToDate(f):
+                mtime, h = known.get(os.path.relpath(f, self.dirname), (None, None))
+                return mtime == os.path.getmtime(f) and h is not None
+            labelFiles = [f for f in labelFiles if not upToDate(f)]
+        if not labelFiles:
+            return 0
+
+        # 每个文件只需要很短的时间 每次交给子进程 64 个文件
+        records = poolMap(_scanLabelFile, [(self.dirname, f) for f in labelFiles],
+                          workers, chunksize=64)
+        count = 0
+        batch = []
+        try:
+            for record in records:
+                count += 1
+                if record:
+                    batch.append(record)
+                # 分批写入 取消时已经读取的文件不必重新读取
+                if len(batch) >= 64:
+                    self._write(batch)
+                    batch = []
+                if cancel is not None and cancel.is_set():
+                    break
+            self._write(batch)
+        finally:
+            records.close()
+        return count
+
+    def labels(self):
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                'SELECT DISTINCT label FROM shapes ORDER BY label')]
+
+    def labelFilesWithLabel(self, label):
+        '''
+        返回包含指定标签的所有标注文件 (相对于工程目录)
+        '''
+        with self._lock:
+            return [row[0] for row in self._db.execute(
+                'SELECT DISTINCT label_file FROM shapes WHERE label = ? ORDER BY label_file',
+                (label,))]
+
+    def labelStatistics(self):
+        '''
+        统计每个标签的标注区域数及图像数
+        返回 [(label, shapeCount, imageCount), ...]
+        '''
+        with self._lock:
+            return list(self._db.execute(
+                'SELECT label, COUNT(*), COUNT(DISTINCT label_file) '
+                'FROM shapes GROUP BY label ORDER BY label'))
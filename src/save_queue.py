@@ -0,0 +1,93 @@
+import os
+import threading
+from collections import OrderedDict
+from PyQt5.QtCore import QObject, pyqtSignal
+
+
+class SaveQueue(QObject):
+    '''
+    后台保存队列
+
+    保存任务在工作线程中依次执行 避免图像编码、写文件等操作阻塞界面
+     - 同一文件的多个未执行任务会被合并 只保留最新的一个
+     - 队列长度有上限 队列已满时 put 会等待
+    '''
+    saving = pyqtSignal(str)    # 开始保存
+    saved = pyqtSignal(str)     # 保存成功
+    failed = pyqtSignal(str, str)   # 保存失败 (文件名, 错误信息)
+
+    def __init__(self, maxsize=8, parent=None):
+        super(SaveQueue, self).__init__(parent)
+        self._maxsize = maxsize
+        self._pending = OrderedDict()   # 文件绝对路径 -> (文件名, 保存任务)
+        self._running = set()   # 正在保存的文件 (绝对路径)
+        self._active = 0    # 正在执行的任务数
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, filename, job):
+        '''
+        添加一个保存任务
+
+        - filename: 保存的目标文件
+        - job: 无参数的可调用对象 在工作线程中执行
+        '''
+        key = os.path.abspath(filename)
+        with self._cond:
+            if key not in self._pending:
+                while len(self._pending) >= self._maxsize:
+                    self._cond.wait()
+            # 合并同一文件的保存任务
+            self._pending[key] = (filename, job)
+            self._cond.notify_all()
+
+    def wait(self, filename):
+        '''
+        等待 filename 的保存任务 (包括尚未执行的任务) 完成
+        读取标注文件前调用 避免读到保存之前的旧内容
+        '''
+        key = os.path.abspath(filename)
+        with self._cond:
+            while key in self._pending or key in self._running:
+                self._cond.wait()
+
+    def join(self):
+        '''
+        等待所有保存任务完成
+        '''
+        with self._cond:
+            while self._pending or self._active:
+                self._cond.wait()
+
+    def isIdle(self):
+        with self._cond:
+            return not self._pending and not self._active
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                key, (filename, job) = self._pending.popitem(last=False)
+                self._running.add(key)
+                self._active += 1
+                self._cond.notify_all()
+
+            self.saving.emit(filename)
+            try:
+                job()
+            except Exception as e:
+                error = str(e)
+            else:
+                error = None
+
+            # 先更新状态再发出信号 槽函数中 isIdle 才能反映本次任务已经结束
+            with self._cond:
+                self._running.discard(key)
+                self._active -= 1
+                self._cond.notify_all()
+            if error is None:
+                self.saved.emit(filename)
+            else:
+                self.failed.emit(filename, error)
@@ -1,8 +1,8 @@
-from copy import deepcopy
 from PyQt5.QtGui import QColor, QPainterPath, QPen
-from PyQt5.QtCore import QRectF
+from PyQt5.QtCore import QRectF, QPointF
 from enum import Enum
 import math
+import numpy as np
 
 
 DEFAULT_LINE_COLOR = QColor(234, 240, 72)    # 浅黄
@@ -13,14 +13,42 @@ DEFAULT_SELECT_FILL_COLOR = QColor(159, 240, 72, 125)    # 浅绿
 DEFAULT_VERTEX_FILL_COLOR = QColor(42, 82, 0, 125)  # 深绿
 DEFAULT_HVERTEX_FILL_COLOR = QColor(199, 179, 229)    # 淡紫
 
+# 所有形状 ShapeStore 的 types 列中记录形状在其中的序号
+SHAPE_TYPES = ('polygon', 'rectangle', 'circle')
+
 
 class highlightMode(Enum):
     NEAT_VERTEX = 0
     MOVE_VERTEX = 1
 
 
+def toArray(points):
+    '''
+    将 QPointF 列表、坐标列表或数组转换为 Nx2 的 float64 数组 (总是复制)
+    '''
+    if not isinstance(points, np.ndarray):
+        points = list(points)
+        if points and hasattr(points[0], 'x'):
+            points = [(p.x(), p.y()) for p in points]
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
 class Shape(object):
+    '''
+    标注区域
+
+    顶点保存在 Nx2 的 float64 数组中 (coords)
+    points 属性及下标访问仍以 QPointF 的形式读写
+    '''
 
+    __slots__ = (
+        'label', 'selected', 'hovered', '_coords', '_closed',
+        '_highlightIndex', '_highlightMode',
+        # 缓存的绘制路径等
+        '_path', '_bbox', '_paintPaths', '_paintKey', '_pen', '_penKey',
+    )
+
+    shape_type = None
     scale = 1.0
     point_size = 8
 
@@ -28,22 +56,69 @@ class Shape(object):
         super().__init__()
 
         self.label = label
-        self.points = points
+        self.coords = toArray(points)
         self.selected = False   # 是否选中
         self.hovered = False    # 鼠标是否悬浮在图形上
         self._closed = False    # 是否闭合
 
         self._highlightIndex = None  # 突出显示的顶点序号
         self._highlightMode = highlightMode.NEAT_VERTEX
+        self._pen = self._penKey = None
+
+    @property
+    def coords(self):
+        '''
+        顶点坐标数组 直接修改其中的元素后需要调用 invalidate
+        '''
+        return self._coords
+
+    @coords.setter
+    def coords(self, value):
+        self._coords = value
+        self.invalidate()
+
+    def attach(self, coords):
+        '''
+        改用 coords 保存顶点 (通常是 ShapeStore 中的视图)
+        coords 与原有的顶点相同时 保留缓存的路径
+        '''
+        if len(coords) == len(self._coords) and np.array_equal(coords, self._coords):
+            self._coords = coords
+        else:
+            self.coords = coords
+
+    @property
+    def points(self):
+        '''
+        以 QPointF 列表的形式返回所有顶点 修改返回的列表不会影响图形
+        '''
+        return [QPointF(x, y) for x, y in self._coords.tolist()]
+
+    @points.setter
+    def points(self, value):
+        self.coords = toArray(value)
+
+    def invalidate(self):
+        '''
+        顶点发生变化后 清除缓存的路径及外接矩形
+        '''
+        self._path = None   # makePath 的结果 用于 containsPoint
+        self._bbox = None
+        self._paintPaths = None  # paint 时使用的 (line_path, vrtx_path)
+        self._paintKey = None
 
     def addPoint(self, point):
-        if self.points and point == self.points[0]:
+        if len(self) and point == self[0]:
             self.close()
         else:
-            self.points.append(point)
+            self.coords = np.vstack([self._coords, (point.x(), point.y())])
 
     def popPoint(self):
-        return self.points.pop() if self.points else None
+        if not len(self):
+            return None
+        point = self[-1]
+        self.coords = self._coords[:-1].copy()
+        return point
 
     def paint(self, painter):
         '''
@@ -51,18 +126,26 @@ class Shape(object):
         使用QPen以及QPainterPath进行绘制
         其中modifyPath方法在不同子类中进行重写
         '''
-        if not self.points:
+        if not len(self):
             return
 
-        color = DEFAULT_SELECT_LINE_COLOR if self.selected else DEFAULT_LINE_COLOR
-        pen = QPen(color)
-        pen.setWidth(max(1, int(round(2.0 / self.scale))))
-        painter.setPen(pen)
-
-        line_path = QPainterPath()
-        vrtx_path = QPainterPath()
-
-        self.modifyPath(line_path, vrtx_path)
+        penKey = (self.selected, self.scale)
+        if penKey != self._penKey:
+            color = DEFAULT_SELECT_LINE_COLOR if self.selected else DEFAULT_LINE_COLOR
+            self._pen = QPen(color)
+            self._pen.setWidth(max(1, int(round(2.0 / self.scale))))
+            self._penKey = penKey
+        painter.setPen(self._pen)
+
+        # 顶点的大小与放缩比例及突出显示的顶点有关
+        paintKey = (self.scale, self._closed, self._highlightIndex, self._highlightMode)
+        if paintKey != self._paintKey:
+            line_path = QPainterPath()
+            vrtx_path = QPainterPath()
+            self.modifyPath(line_path, vrtx_path)
+            self._paintPaths = line_path, vrtx_path
+            self._paintKey = paintKey
+        line_path, vrtx_path = self._paintPaths
 
         painter.drawPath(line_path)
         painter.drawPath(vrtx_path)
@@ -89,7 +172,19 @@ class Shape(object):
         return self._closed
 
     def copy(self):
-        return deepcopy(self)
+        '''
+        复制图形 包括选中、闭合及突出显示的状态 不复制缓存
+        '''
+        shape = type(self).__new__(type(self))
+        shape.label = self.label
+        shape.coords = self._coords.copy()
+        shape.selected = self.selected
+        shape.hovered = self.hovered
+        shape._closed = self._closed
+        shape._highlightIndex = self._highlightIndex
+        shape._highlightMode = self._highlightMode
+        shape._pen = shape._penKey = None
+        return shape
 
     def highlightVertex(self, i, action):
         self._highlightIndex = i
@@ -101,114 +196,124 @@ class Shape(object):
     def makePath(self):
         pass
 
+    def path(self):
+        '''
+        缓存的 makePath 结果 顶点变化前不会重新生成
+        '''
+        if self._path is None:
+            self._path = self.makePath()
+        return self._path
+
     def boundingRect(self):
-        return self.makePath().boundingRect()
+        if self._bbox is None:
+            self._bbox = self.path().boundingRect()
+        return self._bbox
 
     def containsPoint(self, point):
-        return self.makePath().contains(point)
+        return self.path().contains(point)
 
     def moveVertexBy(self, i, offset):
-        self.points[i] = self.points[i] + offset
+        self._coords[i] += (offset.x(), offset.y())
+        self.invalidate()
 
     def moveBy(self, offset):
-        self.points = [p + offset for p in self.points]
+        self._coords += (offset.x(), offset.y())
+        self.invalidate()
 
     def drawVertex(self, path, i):
         d = self.point_size / self.scale
-        point = self.points[i]
+        point = self[i]
         if i == self._highlightIndex:
             d *= 4 if self._highlightMode == highlightMode.NEAT_VERTEX else 1.5
         path.addEllipse(point, d / 2.0, d / 2.0)
 
     def __len__(self):
-        return len(self.points)
+        return len(self._coords)
 
     def __getitem__(self, key):
-        if key > len(self.points):
+        if key >= len(self._coords) or key < -len(self._coords):
             raise IndexError('index out of range')
-        return self.points[key]
+        x, y = self._coords[key].tolist()
+        return QPointF(x, y)
 
     def __setitem__(self, key, val):
-        if key > len(self.points):
+        if key >= len(self._coords) or key < -len(self._coords):
             raise IndexError('assignment index out of range')
-        self.points[key] = val
+        self._coords[key] = (val.x(), val.y())
+        self.invalidate()
 
 
 class Rectangle(Shape):
-    def __init__(self, label=None, points=[]):
-        super().__init__(label=label, points=points)
-        self.shape_type = 'rectangle'
+    __slots__ = ()
+    shape_type = 'rectangle'
 
     def makePath(self):
         path = QPainterPath()
-        assert len(self.points) == 2
-        rectangle = self.getRectFromPoints(self.points)
+        assert len(self) == 2
+        rectangle = self.getRectFromPoints(self._coords)
         path.addRect(rectangle)
         return path
 
     def getRectFromPoints(self, pts):
-        pt1, pt2 = pts[0], pts[1]
-        x1, y1 = pt1.x(), pt1.y()
-        x2, y2 = pt2.x(), pt2.y()
+        (x1, y1), (x2, y2) = pts[:2].tolist()
         return QRectF(x1, y1, x2 - x1, y2 - y1)
 
     # @Overrides(Shape)
     def modifyPath(self, line_path, vrtx_path):
-        assert len(self.points) == 1 or len(self.points) == 2
-        if len(self.points) == 2:
-            rectangle = self.getRectFromPoints(self.points)
+        assert len(self) == 1 or len(self) == 2
+        if len(self) == 2:
+            rectangle = self.getRectFromPoints(self._coords)
             line_path.addRect(rectangle)
-        for i in range(len(self.points)):
+        for i in range(len(self)):
             self.drawVertex(vrtx_path, i)
 
 
 class Polygon(Shape):
-    def __init__(self, label=None, points=[]):
-        super().__init__(label=label, points=points)
-        self.shape_type = 'polygon'
+    __slots__ = ()
+    shape_type = 'polygon'
 
     # @Overrides(Shape)
     def modifyPath(self, line_path, vrtx_path):
-        line_path.moveTo(self.points[0])
-        for i, p in enumerate(self.points):
+        points = self.points
+        line_path.moveTo(points[0])
+        for i, p in enumerate(points):
             line_path.lineTo(p)
             self.drawVertex(vrtx_path, i)
         if self.isClosed():
-            line_path.lineTo(self.points[0])
+            line_path.lineTo(points[0])
 
     def makePath(self):
-        path = QPainterPath(self.points[0])
-        for p in self.points[1:]:
+        points = self.points
+        path = QPainterPath(points[0])
+        for p in points[1:]:
             path.lineTo(p)
         return path
 
 
 class Circle(Shape):
-    def __init__(self, label=None, points=[]):
-        super().__init__(label=label, points=points)
-        self.shape_type = 'circle'
+    __slots__ = ()
+    shape_type = 'circle'
 
     # @Overrides(Shape)
     def modifyPath(self, line_path, vrtx_path):
-        assert len(self.points) == 1 or len(self.points) == 2
-        if len(self.points) == 2:
-            rectangle = self.getCircleFromPoints(self.points)
+        assert len(self) == 1 or len(self) == 2
+        if len(self) == 2:
+            rectangle = self.getCircleFromPoints(self._coords)
             line_path.addEllipse(rectangle)
-        for i in range(len(self.points)):
+        for i in range(len(self)):
             self.drawVertex(vrtx_path, i)
 
     def makePath(self):
         path = QPainterPath()
-        assert len(self.points) == 2
-        circle = self.getCircleFromPoints(self.points)
+        assert len(self) == 2
+        circle = self.getCircleFromPoints(self._coords)
         path.addEllipse(circle)
         return path
 
     def getCircleFromPoints(self, pts):
-        center = pts[0]
-        r = pts[1] - pts[0]
-        d = math.sqrt(math.pow(r.x(), 2) + math.pow(r.y(), 2))
-        rectangle = QRectF(center.x() - d, center.y() - d, 2 * d, 2 * d)
+        (cx, cy), (px, py) = pts[:2].tolist()
+        d = math.hypot(px - cx, py - cy)
+        rectangle = QRectF(cx - d, cy - d, 2 * d, 2 * d)
         return rectangle
 
 
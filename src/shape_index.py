@@ -0,0 +1,113 @@
+import math
+
+
+class ShapeGrid(object):
+    '''
+    标注区域的空间索引 (均匀网格)
+
+    按外接矩形将每个标注区域登记到与之相交的网格中
+    鼠标悬浮、选择时只需检查鼠标所在网格中的标注区域
+    标注区域增删或移动后需要调用 add / remove / update 更新索引
+
+    candidates 按标注区域的添加顺序倒序返回 与 canvas 中从上到下的绘制顺序一致
+    '''
+
+    def __init__(self, cellSize=64):
+        self.cellSize = cellSize
+        self._cells = {}    # (cx, cy) -> set(shape)
+        self._entries = {}  # shape -> (seq, (x1, y1, x2, y2), cells)
+        self._seq = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, shape):
+        return shape in self._entries
+
+    def clear(self):
+        self._cells.clear()
+        self._entries.clear()
+        self._seq = 0
+
+    def rebuild(self, shapes, bboxes=None):
+        '''
+        按顺序重新登记所有标注区域
+        bboxes 为预先算好的外接矩形 (x1, y1, x2, y2) 例如 ShapeStore.boundingBoxes
+        '''
+        self.clear()
+        if bboxes is None:
+            for shape in shapes:
+                self.add(shape)
+            return
+        for shape, bbox in zip(shapes, bboxes.tolist()):
+            self._seq += 1
+            self._insert(shape, self._seq, bbox, self._cellsOf(bbox))
+
+    def add(self, shape):
+        '''
+        登记一个新的标注区域 位于所有已登记区域之上
+        '''
+        self._seq += 1
+        self._insert(shape, self._seq)
+
+    def remove(self, shape):
+        entry = self._entries.pop(shape, None)
+        if entry is None:
+            return
+        for cell in entry[2]:
+            members = self._cells[cell]
+            members.discard(shape)
+            if not members:
+                del self._cells[cell]
+
+    def update(self, shape):
+        '''
+        标注区域移动或修改顶点后 更新其所在的网格 保持原有的顺序
+        '''
+        entry = self._entries.get(shape)
+        if entry is None:
+            return self.add(shape)
+        bbox = self._bbox(shape)
+        cells = self._cellsOf(bbox)
+        if cells == entry[2]:
+            self._entries[shape] = (entry[0], bbox, cells)
+            return
+        self.remove(shape)
+        self._insert(shape, entry[0], bbox, cells)
+
+    def candidates(self, pos, radius=0):
+        '''
+        返回外接矩形向外扩展 radius 后包含 pos 的所有标注区域
+        最上层的标注区域在最前
+        '''
+        x, y = pos.x(), pos.y()
+        found = set()
+        for cell in self._cellsOf((x - radius, y - radius, x + radius, y + radius)):
+            found.update(self._cells.get(cell, ()))
+        result = []
+        for shape in found:
+            seq, (x1, y1, x2, y2), _ = self._entries[shape]
+            if x1 - radius <= x <= x2 + radius and y1 - radius <= y <= y2 + radius:
+                result.append((seq, shape))
+        result.sort(key=lambda item: item[0], reverse=True)
+        return [shape for _, shape in result]
+
+    def _insert(self, shape, seq, bbox=None, cells=None):
+        if bbox is None:
+            bbox = self._bbox(shape)
+            cells = self._cellsOf(bbox)
+        self._entries[shape] = (seq, bbox, cells)
+        for cell in cells:
+            self._cells.setdefault(cell, set()).add(shape)
+
+    @staticmethod
+    def _bbox(shape):
+        rect = shape.boundingRect()
+        return rect.left(), rect.top(), rect.right(), rect.bottom()
+
+    def _cellsOf(self, bbox):
+        s = self.cellSize
+        x1, y1, x2, y2 = bbox
+        cx1, cy1 = math.floor(x1 / s), math.floor(y1 / s)
+        cx2, cy2 = math.floor(x2 / s), math.floor(y2 / s)
+        return frozenset((cx, cy) for cx in range(cx1, cx2 + 1) for cy in range(cy1, cy2 + 1))
@@ -0,0 +1,194 @@
+import numpy as np
+from shape import ShapeFactory, SHAPE_TYPES
+
+
+# flags 中每一位的含义
+FLAG_CLOSED = 1
+FLAG_SELECTED = 2
+
+
+class ShapeStore(object):
+    '''
+    一张图像中所有标注区域的列式存储
+
+    所有顶点连续存放在同一个 Nx2 数组 (vertices) 中
+    第 i 个标注区域的顶点为 vertices[offsets[i]:offsets[i + 1]]
+    labelIds、types、flags 分别记录每个标注区域的标签序号、形状及状态
+    标签名保存在 labels 中
+
+    shapes 中每个 Shape 的顶点数组都是 vertices 的视图
+    移动等原地修改会直接反映在 vertices 中
+    增删标注区域或顶点后 在下一次 pack 时重新打包
+    '''
+
+    def __init__(self):
+        self.shapes = []
+        self.vertices = np.zeros((0, 2), dtype=np.float64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.labelIds = np.zeros(0, dtype=np.int32)
+        self.types = np.zeros(0, dtype=np.uint8)
+        self.flags = np.zeros(0, dtype=np.uint8)
+        self.labels = []
+        self._dirty = False
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def __iter__(self):
+        return iter(self.shapes)
+
+    def __getitem__(self, key):
+        return self.shapes[key]
+
+    def index(self, shape):
+        return self.shapes.index(shape)
+
+    def load(self, shapes):
+        '''
+        从 (label, points, shape_type) 的序列中加载所有标注区域
+        points 为坐标列表或 Nx2 数组 (例如 loadBinaryFile 返回的视图)
+        所有顶点一次性转换为数组 每个 Shape 只保存其中的视图
+        '''
+        shapes = list(shapes)
+        counts = np.array([len(points) for _, points, _ in shapes], dtype=np.int64)
+        offsets = np.zeros(len(shapes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        vertices = np.zeros((offsets[-1], 2), dtype=np.float64)
+        if not len(vertices):
+            pass
+        elif all(isinstance(points, np.ndarray) for _, points, _ in shapes):
+            # 二进制标注文件中的顶点已经是数组 直接拼接 不必转换为列表
+            np.concatenate([points for _, points, _ in shapes], out=vertices)
+        else:
+            vertices[:] = [p for _, points, _ in shapes for p in points]
+
+        self.shapes = []
+        for (label, _, shape_type), start, end in zip(shapes, offsets[:-1], offsets[1:]):
+            shape = ShapeFactory.genShape(name=shape_type, label=label)
+            shape.attach(vertices[start:end])
+            self.shapes.append(shape)
+        self.vertices = vertices
+        self.offsets = offsets
+        self._dirty = False
+        self._updateColumns()
+        return self.shapes
+
+    def clear(self):
+        self.load([])
+
+    def append(self, shape):
+        self.shapes.append(shape)
+        self._dirty = True
+
+    def remove(self, shape):
+        self.shapes.remove(shape)
+        self._dirty = True
+
+    def pop(self):
+        self._dirty = True
+        return self.shapes.pop()
+
+    def isStale(self):
+        '''
+        是否有标注区域的顶点数组不再是 vertices 的视图
+        (增删了标注区域 或添加、删除了顶点)
+        '''
+        return self._dirty or any(s.coords.base is not self.vertices for s in self.shapes)
+
+    def pack(self):
+        '''
+        需要时重新打包顶点 并更新标签、形状及状态列
+        返回 self
+        '''
+        if self.isStale():
+            self._packVertices()
+        self._updateColumns()
+        return self
+
+    def _packVertices(self):
+        counts = np.array([len(s) for s in self.shapes], dtype=np.int64)
+        offsets = np.zeros(len(self.shapes) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        vertices = np.zeros((offsets[-1], 2), dtype=np.float64)
+        for shape, start, end in zip(self.shapes, offsets[:-1], offsets[1:]):
+            vertices[start:end] = shape.coords
+            shape.attach(vertices[start:end])
+        self.vertices = vertices
+        self.offsets = offsets
+        self._dirty = False
+
+    def _updateColumns(self):
+        # 标签及状态可以在不改变顶点的情况下修改 每次打包时重新读取
+        labelIds = {}
+        self.labelIds = np.array([labelIds.setdefault(s.label, len(labelIds))
+                                  for s in self.shapes], dtype=np.int32)
+        self.labels = list(labelIds)
+        self.types = np.array([SHAPE_TYPES.index(s.shape_type) for s in self.shapes],
+                              dtype=np.uint8)
+        self.flags = np.array([(FLAG_CLOSED if s.isClosed() else 0) |
+                               (FLAG_SELECTED if s.selected else 0)
+                               for s in self.shapes], dtype=np.uint8)
+
+    def toJson(self):
+        '''
+        转换为 Json 文件中 shapes 字段的格式
+        所有顶点只转换一次 再按 offsets 切分
+        '''
+        self.pack()
+        points = self.vertices.tolist()
+        offsets = self.offsets.tolist()
+        return [dict(
+            label=shape.label,
+            points=points[start:end],
+            shape_type=shape.shape_type,
+        ) for shape, start, end in zip(self.shapes, offsets[:-1], offsets[1:])]
+
+    def boundingBoxes(self):
+        '''
+        所有标注区域的外接矩形 返回 Nx4 数组 (x1, y1, x2, y2)
+        圆形为圆心加减半径 其余为顶点坐标的最小、最大值 没有顶点时为 0
+        '''
+        self.pack()
+        n = len(self.shapes)
+        boxes = np.zeros((n, 4), dtype=np.float64)
+        counts = np.diff(self.offsets)
+        valid = counts > 0
+        if not valid.any():
+            return boxes
+        starts = self.offsets[:-1][valid]
+        boxes[valid, :2] = np.minimum.reduceat(self.vertices, starts, axis=0)
+        boxes[valid, 2:] = np.maximum.reduceat(self.vertices, starts, axis=0)
+
+        circles = np.nonzero((self.types == SHAPE_TYPES.index('circle')) & (counts >= 2))[0]
+        if len(circles):
+            center = self.vertices[self.offsets[circles]]
+            r = np.hypot(*(self.vertices[self.offsets[circles] + 1] - center).T)[:, None]
+            boxes[circles, :2] = center - r
+            boxes[circles, 2:] = center + r
+        return boxes
+
+    def labelCounts(self):
+        '''
+        每个标签的标注区域数 {label: count}
+        '''
+        self.pack()
+        counts = np.bincount(self.labelIds, minlength=len(self.labels))
+        return dict(zip(self.labels, counts.tolist()))
+
+    def translate(self, shapes, offset):
+        '''
+        将多个标注区域一起平移 offset 为 (dx, dy)
+        所有顶点在一次数组运算中移动 用于拖动选中的标注区域
+        '''
+        if not shapes:
+            return
+        # 只检查需要移动的标注区域 拖动时不必每次遍历所有标注区域
+        if self._dirty or any(s.coords.base is not self.vertices for s in shapes):
+            self._packVertices()
+        indices = np.array([self.shapes.index(s) for s in shapes], dtype=np.int64)
+        starts, counts = self.offsets[indices], np.diff(self.offsets)[indices]
+        # 各个标注区域的顶点在 vertices 中的行号
+        rows = np.arange(counts.sum()) + np.repeat(starts - (np.cumsum(counts) - counts), counts)
+        self.vertices[rows] += offset
+        for shape in shapes:
+            shape.invalidate()
@@ -0,0 +1,194 @@
+'''
+打包导出的训练数据 (tar 分片)
+
+每个 Json 文件对应一个样本 包括:
+    <key>.jpg / <key>.png   图像文件的原始字节 (其他格式转换为 PNG)
+    <key>.label.png         标签图 所有样本使用相同的类别编号
+    <key>.json              样本信息 (来源文件、图像尺寸、出现的标签)
+同一样本的文件在分片中连续存放 每个分片包含若干样本
+训练时可以按顺序读取整个分片 避免大量小文件的随机读取
+
+输出目录中的 index.json 记录了类别列表、所有分片及每个样本所在的分片和偏移
+'''
+import io
+import os
+import glob
+import json
+import time
+import tarfile
+import PIL.Image
+from tools import loadImageBytes, shapes_to_label, label_image, isLabelData, \
+    exportOptions, scan_label_names, poolMap, PASSTHROUGH_SIGNATURES, PNG_SIGNATURE, \
+    NOT_LABEL_FILE
+
+
+INDEX = 'index.json'
+SHARD_NAME = 'shard-{:06d}.tar'
+
+
+def _image_member(imageBytes):
+    '''
+    返回 (扩展名, 字节) JPEG / PNG 直接使用原始字节
+    '''
+    if imageBytes.startswith(PNG_SIGNATURE):
+        return 'png', imageBytes
+    if imageBytes.startswith(PASSTHROUGH_SIGNATURES):
+        return 'jpg', imageBytes
+    with io.BytesIO() as f:
+        PIL.Image.open(io.BytesIO(imageBytes)).save(f, format='PNG')
+        return 'png', f.getvalue()
+
+
+def _encode_sample(args):
+    '''
+    生成一个样本的所有文件 在进程池中执行
+    返回 (filename, members, error) members 为 [(后缀, 字节), ...]
+    不是标注文件时 members 及 error 均为 None
+    '''
+    filename, options = args
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError('expected an object in json file')
+        if not isLabelData(data):
+            return filename, None, None
+        ext, imageBytes = _image_member(loadImageBytes(filename, data))
+        if data.get('imageHeight') and data.get('imageWidth'):
+            imgShape = (data['imageHeight'], data['imageWidth'])
+        else:
+            imgShape = PIL.Image.open(io.BytesIO(imageBytes)).size[::-1]
+
+        label_name_to_value = {ln: lv for lv, ln in enumerate(options['labelNames'])}
+        labels = [s['label'] for s in data['shapes']]
+        unknown = set(labels) - set(label_name_to_value)
+        if unknown:
+            raise ValueError('labels not in label names: {}'.format(', '.join(sorted(unknown))))
+        lbl = shapes_to_label(imgShape, data['shapes'], label_name_to_value)
+        labelFormat = options['labelFormat'] if len(label_name_to_value) <= 256 else 'int32'
+        with io.BytesIO() as f:
+            label_image(lbl, labelFormat).save(
+                f, format='PNG', compress_level=options['compressLevel'])
+            labelBytes = f.getvalue()
+
+        info = dict(
+            source=os.path.basename(filename),
+            imageHeight=imgShape[0],
+            imageWidth=imgShape[1],
+            labels=sorted(set(labels)),
+        )
+        members = [
+            (ext, imageBytes),
+            ('label.png', labelBytes),
+            ('json', json.dumps(info, ensure_ascii=False).encode('utf-8')),
+        ]
+    except Exception as e:
+        return filename, None, '{}: {}'.format(type(e).__name__, e)
+    return filename, members, None
+
+
+class _ShardWriter(object):
+    '''
+    依次写入样本 样本数或文件大小达到上限时开始新的分片
+    '''
+
+    def __init__(self, out_dir, samples_per_shard, max_shard_size):
+        self.out_dir = out_dir
+        self.samples_per_shard = samples_per_shard
+        self.max_shard_size = max_shard_size
+        self.shards = []    # [{name, samples, size}, ...]
+        self.samples = []   # [{key, shard, members: {后缀: [offset, size]}}, ...]
+        self._tar = None
+        self._count = 0
+
+    def write(self, key, members):
+        if self._tar is None or self._count >= self.samples_per_shard or \
+                (self.max_shard_size and self._tar.offset >= self.max_shard_size):
+            self._next()
+        offsets = {}
+        mtime = time.time()
+        for suffix, content in members:
+            info = tarfile.TarInfo('{}.{}'.format(key, suffix))
+            info.size = len(content)
+            info.mtime = mtime
+            # 记录数据在分片中的偏移 可以不解析 tar 直接读取
+            header = info.tobuf(self._tar.format, self._tar.encoding, self._tar.errors)
+            offsets[suffix] = [self._tar.offset + len(header), info.size]
+            self._tar.addfile(info, io.BytesIO(content))
+        self.samples.append(dict(key=key, shard=len(self.shards) - 1, members=offsets))
+        self._count += 1
+
+    def _next(self):
+        self.close()
+        name = SHARD_NAME.format(len(self.shards))
+        self.shards.append(dict(name=name, samples=0, size=0))
+        self._tar = tarfile.open(os.path.join(self.out_dir, name), 'w', format=tarfile.USTAR_FORMAT)
+        self._count = 0
+
+    def close(self):
+        if self._tar is None:
+            return
+        self._tar.close()
+        shard = self.shards[-1]
+        shard['samples'] = self._count
+        shard['size'] = os.path.getsize(os.path.join(self.out_dir, shard['name']))
+        self._tar = None
+
+
+def iter_export_shards(filenames, out_dir, samples_per_shard=1000, max_shard_size=None,
+                       options=None, workers=None):
+    '''
+    将多个 Json 文件打包为 tar 分片 保存在 out_dir 中
+
+    - samples_per_shard: 每个分片的最大样本数
+    - max_shard_size: 分片文件的大小上限 (字节) 超过后开始新的分片 为 None 时不限制
+    - options: 导出选项 见 tools.DEFAULT_EXPORT_OPTIONS
+      只使用 labelNames、labelFormat 及 compressLevel
+      未指定 labelNames 时先扫描所有文件 使所有样本的类别编号一致
+    - workers: 进程池大小 默认为 CPU 核心数
+
+    样本按 filenames 的顺序写入 每处理一个文件返回一次 (filename, error, skipped)
+    skipped 为 None 或 tools.NOT_LABEL_FILE (不是标注文件 不写入分片)
+    全部完成后写入 index.json
+    '''
+    filenames = list(filenames)
+    options = exportOptions(options)
+    if options['labelNames'] is None:
+        options['labelNames'] = scan_label_names(filenames, workers)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    # 删除之前的索引 导出中断时不会使用不完整的分片
+    index = os.path.join(out_dir, INDEX)
+    if os.path.exists(index):
+        os.remove(index)
+    for shard in glob.glob(os.path.join(out_dir, SHARD_NAME.replace('{:06d}', '*'))):
+        os.remove(shard)
+
+    writer = _ShardWriter(out_dir, samples_per_shard, max_shard_size)
+    keys = set()
+    # 按顺序返回结果 内存中最多保留 4 * workers 个样本
+    results = poolMap(_encode_sample, [(f, options) for f in filenames], workers)
+    try:
+        for filename, members, error in results:
+            if error is None and members is None:
+                yield filename, None, NOT_LABEL_FILE
+                continue
+            if error is None:
+                # 读取分片时以第一个 . 区分样本名及后缀
+                key = os.path.splitext(os.path.basename(filename))[0].replace('.', '_')
+                # 不同目录中可能有同名文件
+                if key in keys:
+                    key = '{}_{}'.format(key, len(writer.samples))
+                keys.add(key)
+                writer.write(key, members)
+            yield filename, error, None
+    finally:
+        writer.close()
+        results.close()
+
+    with open(index, 'w') as f:
+        json.dump(dict(
+            labelNames=options['labelNames'],
+            shards=writer.shards,
+            samples=writer.samples,
+        ), f, ensure_ascii=False)
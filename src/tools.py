@@ -1,11 +1,20 @@
 import math
-from PyQt5.QtCore import QPoint
+import functools
+import re
 import PIL.Image
 import PIL.ImageDraw
+import PIL.ImageFont
 import io
 import os
 import json
+import shutil
 import base64
+import hashlib
+import tempfile
+import contextlib
+import collections
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
 import numpy as np
 import yaml
 
@@ -29,15 +38,38 @@ def closeEnough(p1, p2, epsilon):
     return distance(p1 - p2) < epsilon
 
 
+def nearestShapeVertex(shapes, pos, scale):
+    '''
+    在多个标注区域中寻找与 pos 距离不超过 10 / scale 的顶点
+
+    -shapes: 按从上到下的顺序排列的标注区域
+    -pos: QPoint / QPointF
+    所有顶点的距离在一次数组运算中算出
+    返回最上层的满足条件的标注区域及其中最接近的顶点序号 (shape, index)
+    没有满足条件的顶点时返回 (None, None)
+    '''
+    shapes = list(shapes)
+    coords = [s.coords for s in shapes]
+    counts = np.fromiter(map(len, coords), dtype=np.int64, count=len(coords))
+    if not counts.sum():
+        return None, None
+    vertices = np.concatenate(coords)
+    dist = np.square(vertices[:, 0] - pos.x()) + np.square(vertices[:, 1] - pos.y())
+    near = np.flatnonzero(dist <= (10.0 / scale)**2)
+    if not len(near):
+        return None, None
+    # 顶点按标注区域依次排列 第一个满足条件的顶点属于最上层的标注区域
+    ends = np.cumsum(counts)
+    i = int(np.searchsorted(ends, near[0], side='right'))
+    start = ends[i] - counts[i]
+    return shapes[i], int(np.argmin(dist[start:ends[i]]))
+
+
 def nearestVertex(shape, pos, scale):
-    min_distance = float('inf')
-    min_i = None
-    for i, p in enumerate(shape.points):
-        dist = distance(p - pos)
-        if dist <= 10.0 / scale and dist < min_distance:
-            min_distance = dist
-            min_i = i
-    return min_i
+    '''
+    返回 shape 中与 pos 距离不超过 10 / scale 的最接近的顶点序号 没有时返回 None
+    '''
+    return nearestShapeVertex([shape], pos, scale)[1]
 
 
 def outOfPixmap(pixmap, pos):
@@ -62,6 +94,9 @@ def intersectionPoint(pixmap, p1, p2):
     计算点的正确显示位置
     此段代码来源于 Labelme 的源代码
     '''
+    # 在函数内导入 使命令行工具不依赖 PyQt5
+    from PyQt5.QtCore import QPoint
+
     # Cycle through each image edge in clockwise fashion,
     # and find the one intersecting the current line segment.
     # http://paulbourke.net/geometry/lineline2d/
@@ -115,14 +150,32 @@ def intersectionPoint(pixmap, p1, p2):
     return QPoint(x, y)
 
 
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# 可以直接嵌入 Json 文件的图像格式 (文件头)
+PASSTHROUGH_SIGNATURES = (
+    b'\xff\xd8\xff',  # JPEG
+    PNG_SIGNATURE,
+)
+
+
 def getImageData(filename):
-    image_pil = PIL.Image.open(filename)
+    '''
+    获取需要嵌入 Json 文件的图像数据
+
+    对于 JPEG / PNG 图像 直接使用原文件的字节内容
+    避免重复解码、编码带来的耗时及有损压缩的画质损失
+    其余格式才使用 PIL 转换为 PNG
+    '''
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if data.startswith(PASSTHROUGH_SIGNATURES):
+        return data
+
+    image_pil = PIL.Image.open(io.BytesIO(data))
     with io.BytesIO() as f:
-        ext = os.path.splitext(filename)[1].lower()
-        format = 'JPEG' if ext in ['.jpg', '.jpeg'] else 'PNG'
-        image_pil.save(f, format=format)
-        f.seek(0)
-        return f.read()
+        image_pil.save(f, format='PNG')
+        return f.getvalue()
 
 
 def restoreFromImageData(data):
@@ -132,7 +185,66 @@ def restoreFromImageData(data):
     return img_arr
 
 
-def saveJsonFile(filename, shapes, imagePath, imageData, imageHeight, imageWidth):
+def hashFile(filename):
+    '''
+    计算文件内容的 sha1 值
+    引用模式下用于校验 Json 文件所指向的图像是否发生了变化
+    导出数据集时用于判断 Json 文件是否发生了变化
+    '''
+    h = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def resolveImagePath(jsonFile, imagePath):
+    '''
+    将 Json 文件中记录的 imagePath 转换为可以直接打开的路径
+
+    引用模式下 imagePath 为相对于 Json 文件所在目录的相对路径
+    (位于不同驱动器时为绝对路径)
+    '''
+    if os.path.isabs(imagePath):
+        return imagePath
+    return os.path.join(os.path.dirname(jsonFile), imagePath)
+
+
+def loadImageBytes(jsonFile, data):
+    '''
+    获取 Json 文件对应图像文件的原始字节
+
+    - 嵌入模式: 从 imageData 中解码 base64
+    - 引用模式: 根据 imagePath 从磁盘读取，并校验 imageHash
+    '''
+    if data.get('imageData') is not None:
+        return base64.b64decode(data['imageData'])
+    imagePath = resolveImagePath(jsonFile, data['imagePath'])
+    with open(imagePath, 'rb') as f:
+        imageBytes = f.read()
+    imageHash = data.get('imageHash')
+    if imageHash and hashlib.sha1(imageBytes).hexdigest() != imageHash:
+        raise ValueError('image file changed: {}'.format(imagePath))
+    return imageBytes
+
+
+def loadImageArray(jsonFile, data):
+    '''
+    获取 Json 文件对应的图像 见 loadImageBytes
+    '''
+    return np.array(PIL.Image.open(io.BytesIO(loadImageBytes(jsonFile, data))))
+
+
+def saveJsonFile(filename, shapes, imagePath, imageData, imageHeight, imageWidth, **extra):
+    '''
+    保存标注结果
+
+    imageData 为 None 时即为引用模式 只记录图像路径
+    extra 中的内容 (如 imageHash) 会作为额外字段写入
+
+    先写入同目录下的临时文件 再替换目标文件
+    保证目标文件在任何时候都是完整的
+    '''
     # 转换为 base64 编码
     if imageData is not None:
         imageData = base64.b64encode(imageData).decode('utf-8')
@@ -143,44 +255,589 @@ def saveJsonFile(filename, shapes, imagePath, imageData, imageHeight, imageWidth
         imageHeight=imageHeight,
         imageWidth=imageWidth,
     )
-    with open(filename, 'w') as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    data.update(extra)
+    fd, tmp = tempfile.mkstemp(
+        prefix='.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(filename)))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        # mkstemp 创建的文件只有所有者可读写
+        os.chmod(tmp, os.stat(filename).st_mode if os.path.exists(filename) else 0o644)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
+
+
+def saveLabelFile(filename, shapes, imageFile, imageHeight, imageWidth, embedImageData=True, **extra):
+    '''
+    根据图像文件保存标注结果
+    包括读取图像数据、计算哈希值等较为耗时的操作 可以在后台线程中调用
 
+    - embedImageData: True 为嵌入模式 False 为引用模式
+    - extra: 额外写入的字段 例如 journalSeq
+    返回引用模式下图像的哈希值 嵌入模式下返回 None
+    '''
+    if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+
+    if embedImageData:
+        # 嵌入模式
+        # 获得源图像的base64编码
+        imagePath = imageFile
+        imageData = getImageData(imageFile)
+    else:
+        # 引用模式
+        # 只记录相对于 Json 文件的图像路径及其哈希值
+        try:
+            imagePath = os.path.relpath(
+                imageFile, os.path.dirname(os.path.abspath(filename)))
+        except ValueError:
+            # Windows 下 Json 文件与图像位于不同的驱动器时无法使用相对路径
+            imagePath = os.path.abspath(imageFile)
+        imageData = None
+        extra['imageHash'] = hashFile(imageFile)
+
+    # 保存为 Json 格式
+    saveJsonFile(filename, shapes, imagePath, imageData,
+                 imageHeight, imageWidth, **extra)
+    return extra.get('imageHash')
+
+
+class _JsonMemberReader(object):
+    '''
+    逐块读取 Json 文件的顶层字段
 
-def loadJsonFile(filename):
+    对于需要跳过的字符串字段 (如 imageData)
+    只扫描其结束位置 不进行解码 也不会完整地保存在内存中
+    '''
+
+    CHUNK_SIZE = 1 << 16
+    _whitespace = re.compile(r'[ \t\n\r]*')
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+
+    def _fill(self, size=None):
+        chunk = self.f.read(size or self.CHUNK_SIZE)
+        if not chunk:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            self.pos = self._whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of json file')
+
+    def _expect(self, ch):
+        if self._peek() != ch:
+            raise ValueError('expected {!r} at {}'.format(ch, self.pos))
+        self.pos += 1
+
+    def _decode(self):
+        self._peek()
+        size = self.CHUNK_SIZE
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill(size):
+                    raise
+            else:
+                # 数字可能恰好在缓冲区末尾被截断 例如 "-12." 会被解析为 -12
+                # 之后的字符为 , } 或 : 时才说明值已经完整
+                nxt = self._whitespace.match(self.buf, end).end()
+                if (nxt < len(self.buf) and self.buf[nxt] in ',}:') or not self._fill(size):
+                    self.pos = end
+                    return value
+            size *= 2
+
+    def _skipString(self):
+        self._expect('"')
+        while True:
+            i = self.buf.find('"', self.pos)
+            if i < 0:
+                # 保留末尾的反斜杠 用于判断下一块开头的引号是否被转义
+                self.pos = len(self.buf) - \
+                    (len(self.buf) - len(self.buf.rstrip('\\')))
+                if not self._fill():
+                    raise ValueError('unterminated string in json file')
+                continue
+            j = i
+            while j > self.pos and self.buf[j - 1] == '\\':
+                j -= 1
+            self.pos = i + 1
+            if (i - j) % 2 == 0:
+                return
+
+    def members(self, skip=()):
+        '''
+        依次返回顶层字段的 (key, value)
+        skip 中的字段不会被返回
+        '''
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._decode()
+            self._expect(':')
+            if key in skip and self._peek() == '"':
+                self._skipString()
+            elif key in skip:
+                self._decode()
+            else:
+                yield key, self._decode()
+            ch = self._peek()
+            self.pos += 1
+            if ch == '}':
+                return
+            if ch != ',':
+                raise ValueError("expected ',' or '}}' at {}".format(self.pos))
+
+
+def loadJsonInfo(filename, skip=('imageData',)):
+    '''
+    读取 Json 文件中除 skip 以外的所有顶层字段
+
+    默认跳过 imageData
+    只需要标注区域及图像尺寸等信息时 不必解析整个 base64 字符串
+    '''
     with open(filename, 'r') as f:
-        data = json.load(f)
-        assert data['imageData'] is not None
-        shapes = (
-            (
-                s['label'],
-                s['points'],
-                s.get('shape_type', 'polygon'),
-            )
-            for s in data['shapes']
+        return dict(_JsonMemberReader(f).members(skip))
+
+
+def isLabelData(data):
+    '''
+    Json 文件的内容是否为标注文件 (包含 shapes 及 imagePath)
+    目录中可能还有导出的 COCO 标注、分片索引等其他 Json 文件
+    '''
+    return 'shapes' in data and 'imagePath' in data
+
+
+def formatShapes(shapes):
+    '''
+    将 Json 文件中的 shapes 字段转换为 (label, points, shape_type) 的形式
+    '''
+    return (
+        (
+            s['label'],
+            s['points'],
+            s.get('shape_type', 'polygon'),
         )
-        return shapes
+        for s in shapes
+    )
+
+
+def loadJsonFile(filename):
+    data = loadJsonInfo(filename)
+    return formatShapes(data['shapes'])
+
+
+def getJsonImagePath(filename):
+    '''
+    获取 Json 文件所对应图像的路径
+    '''
+    data = loadJsonInfo(filename)
+    return resolveImagePath(filename, data['imagePath'])
+
+
+PROJECT_CONFIG = '.labelit.yaml'
+
+
+def loadProjectConfig(dirname):
+    '''
+    读取目录下的工程配置
+    目前包括:
+     - embedImageData: 是否在 Json 文件中嵌入图像数据 (默认为 True)
+     - autosave: 是否将每次修改记录到日志文件中并自动保存 (默认为 False)
+     - workers: 转换数据集时使用的进程数 0 表示使用 CPU 核心数
+     - export: 转换数据集时的导出选项 见 DEFAULT_EXPORT_OPTIONS
+     - scanLabels: 转换前是否扫描所有选中的文件 使它们的类别编号一致
+    '''
+    config = dict(embedImageData=True, autosave=False, workers=0, export={}, scanLabels=False)
+    path = os.path.join(dirname, PROJECT_CONFIG)
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            config.update(yaml.safe_load(f) or {})
+    return config
+
+
+def saveProjectConfig(dirname, config):
+    with open(os.path.join(dirname, PROJECT_CONFIG), 'w') as f:
+        yaml.safe_dump(config, f, default_flow_style=False)
+
+
+def processPool(workers=None):
+    '''
+    创建进程池 workers 为 None 或 0 时使用 CPU 核心数
+
+    界面程序中存在其他线程 使用 spawn 方式创建子进程更为安全
+    '''
+    return ProcessPoolExecutor(workers or None,
+                               mp_context=multiprocessing.get_context('spawn'))
+
+
+def _mapChunk(func, chunk):
+    return [func(arg) for arg in chunk]
+
 
+def poolMap(func, args, workers=None, chunksize=1, window=None, poll=None):
+    '''
+    在进程池中执行 func 按 args 的顺序依次返回结果
+
+    - workers: 进程池大小 默认为 CPU 核心数 不超过任务块数
+    - chunksize: 每次交给子进程的参数个数
+      参数不超过一块时直接在当前进程中执行 省去启动子进程的开销
+    - window: 最多同时提交的任务块数 默认为 4 * workers
+      某个任务较慢时 已完成的结果不会无限积压
+    - poll: 不为 None 时 每隔 poll 秒仍没有结果则返回 None 便于调用者处理界面事件
+
+    生成器被关闭时 取消尚未开始的任务
+    '''
+    args = list(args)
+    if workers == 1 or len(args) <= chunksize:
+        for arg in args:
+            yield func(arg)
+        return
+    chunks = iter([args[i:i + chunksize] for i in range(0, len(args), chunksize)])
+    workers = min(workers or os.cpu_count(), (len(args) + chunksize - 1) // chunksize)
+    executor = processPool(workers)
+    try:
+        pending = collections.deque(
+            executor.submit(_mapChunk, func, chunk)
+            for _, chunk in zip(range(window or 4 * workers), chunks))
+        while pending:
+            if poll is not None and not wait([pending[0]], timeout=poll).done:
+                yield None
+                continue
+            future = pending.popleft()
+            # 先提交下一块 再返回结果 子进程不必等待调用者
+            chunk = next(chunks, None)
+            if chunk is not None:
+                pending.append(executor.submit(_mapChunk, func, chunk))
+            yield from future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# _convert_one 返回的跳过转换的原因
+UP_TO_DATE = 'up to date'
+NOT_LABEL_FILE = 'not a label file'
+
+
+def _convert_one(filename, options=None, force=False):
+    '''
+    在子进程中转换一个文件
+    返回 (filename, error, skipped)
+     - error: 转换成功时为 None
+     - skipped: 进行了转换时为 None 否则为跳过的原因
+       UP_TO_DATE: 输出已是最新
+       NOT_LABEL_FILE: 不是标注文件 (例如导出的 COCO 标注、分片索引)
+    '''
+    try:
+        converted = _json_to_dataset(filename, options, force)
+    except Exception as e:
+        return filename, '{}: {}'.format(type(e).__name__, e), None
+    if converted is None:
+        return filename, None, NOT_LABEL_FILE
+    return filename, None, None if converted else UP_TO_DATE
+
+
+def iter_json_to_dataset(filenames, workers=None, poll=0.1, options=None, force=False):
+    '''
+    使用进程池并行转换多个 Json 文件
 
-def json_to_dataset(filename):
+    按 filenames 的顺序依次返回 (filename, error, skipped) 见 _convert_one
+    每隔 poll 秒仍没有文件完成时返回 None 便于调用者处理界面事件
+    生成器被关闭时 取消尚未开始的任务 见 poolMap
+
+    - options: 导出选项 见 DEFAULT_EXPORT_OPTIONS
+    - force: 为 True 时忽略 manifest 重新转换所有文件
+    '''
+    convert = functools.partial(_convert_one, options=options, force=force)
+    return poolMap(convert, filenames, workers, poll=poll)
+
+
+def json_to_dataset(filename, workers=None, options=None, force=False):
+    '''
+    转换多个 Json 文件
+    返回 (成功数, 失败数) 跳过的文件计入成功数 不是标注文件的 Json 文件不计入
+    '''
     success = fail = 0
-    for f in filename:
-        if _json_to_dataset(f):
+    for result in iter_json_to_dataset(filename, workers, options=options, force=force):
+        if result is None or result[2] == NOT_LABEL_FILE:
+            continue
+        if result[1] is None:
             success += 1
         else:
             fail += 1
     return success, fail
 
 
-def _json_to_dataset(filename):
-    data = json.load(open(filename))
-    img = restoreFromImageData(data['imageData'])
+# 转换结果的格式发生变化时增加该值 使之前导出的数据集全部重新生成
+CONVERTER_VERSION = 3
+
+# 可以导出的文件
+ARTIFACTS = {
+    'img': 'img.png',
+    'label': 'label.png',
+    'label_viz': 'label_viz.png',
+    'label_names': 'label_names.txt',
+    'info': 'info.yaml',
+}
+
+# 导出选项 记录在 manifest 中 选项变化时重新导出
+#  - artifacts: 需要导出的文件 见 ARTIFACTS
+#    只用于训练时通常只需要 label 及 label_names
+#  - labelFormat: label.png 的格式
+#    palette 为嵌入了 colormap 的 8 位调色板图像 类别数超过 256 时自动使用 int32
+#    int32 为 32 位整数图像 (PIL 的 'I' 模式)
+#  - compressLevel: PNG 的压缩级别 0 ~ 9 越小写入越快 文件越大
+#  - labelNames: 所有文件共用的类别列表 第 i 个类别在 label.png 中的值为 i
+#    为 None 时每个文件按标签出现的顺序单独编号
+#    可以通过 scan_label_names 或 load_label_names 获得
+#  - tileSize: 不为 None 时分块绘制标签图 保存为 label_tiles 目录中的多个 PNG
+#    内存占用只与分块大小有关 适合超大图像
+#    此时 img 及 label_viz 仍需要完整的图像 通常只导出 label 及 label_names
+DEFAULT_EXPORT_OPTIONS = dict(
+    artifacts=['img', 'label', 'label_viz', 'label_names', 'info'],
+    labelFormat='palette',
+    compressLevel=6,
+    labelNames=None,
+    tileSize=None,
+)
+
+# 分块导出标签图时使用的目录 及其中记录分块信息的文件
+TILES_DIR = 'label_tiles'
+TILES_INFO = 'tiles.yaml'
+
+BACKGROUND = '_background_'
+
+LABEL_FORMATS = ('palette', 'int32')
+
+MANIFEST = 'manifest.json'
+
+
+def isDatasetDir(dirname):
+    '''
+    是否为 _json_to_dataset 导出的数据集目录
+    即以 _dataset 结尾且包含 manifest 的目录 其中的 Json 文件不是标注文件
+    '''
+    return dirname.rstrip('/' + os.sep).endswith('_dataset') and \
+        os.path.isfile(os.path.join(dirname, MANIFEST))
 
-    label_name_to_value = {'_background_': 0}
-    for shape in data['shapes']:
-        label_name = shape['label']
-        label_value = label_name_to_value.get(label_name, len(label_name_to_value))
-        label_name_to_value[label_name] = label_value
+
+def exportOptions(options=None):
+    '''
+    将 options 与默认导出选项合并
+    '''
+    result = dict(DEFAULT_EXPORT_OPTIONS)
+    result.update(options or {})
+    unknown = set(result['artifacts']) - set(ARTIFACTS)
+    if unknown:
+        raise ValueError('unknown artifacts: {}'.format(', '.join(sorted(unknown))))
+    if result['labelFormat'] not in LABEL_FORMATS:
+        raise ValueError('unknown label format: {}'.format(result['labelFormat']))
+    if not 0 <= result['compressLevel'] <= 9:
+        raise ValueError('compress level must be between 0 and 9')
+    # 按 ARTIFACTS 中的顺序排列 使 manifest 中的记录与传入的顺序无关
+    result['artifacts'] = [a for a in ARTIFACTS if a in result['artifacts']]
+    if result['tileSize'] is not None and result['tileSize'] <= 0:
+        raise ValueError('tile size must be positive')
+    if result['labelNames'] is not None:
+        labelNames = list(result['labelNames'])
+        if len(set(labelNames)) != len(labelNames):
+            raise ValueError('duplicate label names')
+        if BACKGROUND in labelNames:
+            labelNames.remove(BACKGROUND)
+        result['labelNames'] = [BACKGROUND] + labelNames
+    return result
+
+
+def _scan_labels(filename):
+    '''
+    读取一个 Json 文件中的所有标签 在进程池中执行
+    不是标注文件时返回空列表
+    '''
+    data = loadJsonInfo(filename)
+    if not isLabelData(data):
+        return []
+    return [s['label'] for s in data['shapes']]
+
+
+def scan_label_names(filenames, workers=None):
+    '''
+    预先扫描所有 Json 文件 收集其中出现的标签
+    只读取 shapes 字段 不解析 imageData 也不解码图像
+    跳过不是标注文件的 Json 文件
+
+    返回排序后的标签列表 _background_ 在最前
+    可以作为导出选项中的 labelNames 使所有文件的类别编号一致
+    '''
+    labels = set()
+    # 每个文件只需要很短的时间 每次交给子进程 64 个文件
+    for result in poolMap(_scan_labels, filenames, workers, chunksize=64):
+        labels.update(result)
+    labels.discard(BACKGROUND)
+    return [BACKGROUND] + sorted(labels)
+
+
+def load_label_names(filename):
+    '''
+    读取类别列表文件 每行一个类别 格式与导出的 label_names.txt 相同
+    忽略空行 _background_ 不在第一行时自动添加
+    '''
+    with open(filename, 'r') as f:
+        labels = [line.strip() for line in f if line.strip()]
+    return exportOptions(dict(labelNames=labels))['labelNames']
+
+
+def _dataset_outputs(options):
+    '''
+    导出目录中应当包含的文件
+    '''
+    outputs = [ARTIFACTS[a] for a in options['artifacts']]
+    if options['tileSize'] and 'label' in options['artifacts']:
+        outputs[outputs.index(ARTIFACTS['label'])] = os.path.join(TILES_DIR, TILES_INFO)
+    return outputs
+
+
+def label_image(lbl, labelFormat):
+    '''
+    将 shapes_to_label 生成的标签图转换为 PIL 图像
+    '''
+    if labelFormat == 'palette' and lbl.min() >= 0 and lbl.max() < 256:
+        image = PIL.Image.fromarray(lbl.astype(np.uint8), mode='P')
+        image.putpalette(label_colormap_lut().tobytes())
+        return image
+    return PIL.Image.fromarray(lbl.astype(np.int32))
+
+
+def _save_label_tiles(tiles_dir, img_shape, shapes, label_name_to_value, tile_size,
+                      labelFormat, compressLevel):
+    '''
+    分块绘制标签图 每个分块保存为 tiles_dir 中的 <row>_<col>.png
+    最后写入记录图像尺寸及分块大小的 tiles.yaml
+    '''
+    # 分块的数量可能发生变化 删除之前导出的所有分块
+    if os.path.exists(tiles_dir):
+        shutil.rmtree(tiles_dir)
+    os.mkdir(tiles_dir)
+    rows = cols = 0
+    for row, col, tile in shapes_to_label_tiles(img_shape, shapes, label_name_to_value,
+                                                tile_size):
+        label_image(tile, labelFormat).save(
+            os.path.join(tiles_dir, '{}_{}.png'.format(row, col)),
+            compress_level=compressLevel)
+        rows, cols = max(rows, row + 1), max(cols, col + 1)
+    info = dict(imageHeight=img_shape[0], imageWidth=img_shape[1],
+                tileSize=tile_size, rows=rows, cols=cols)
+    with open(os.path.join(tiles_dir, TILES_INFO), 'w') as f:
+        yaml.safe_dump(info, f, default_flow_style=False)
+
+
+def _dataset_manifest(filename, options, previous=None):
+    '''
+    生成 Json 文件对应的 manifest
+    文件大小及修改时间与 previous 一致时 直接沿用其中的哈希值
+    '''
+    stat = os.stat(filename)
+    manifest = dict(
+        version=CONVERTER_VERSION,
+        options=options,
+        outputs=_dataset_outputs(options),
+        inputSize=stat.st_size,
+        inputMtime=stat.st_mtime,
+    )
+    if previous and previous.get('inputSize') == stat.st_size and \
+            previous.get('inputMtime') == stat.st_mtime:
+        manifest['inputHash'] = previous.get('inputHash')
+    else:
+        manifest['inputHash'] = hashFile(filename)
+    return manifest
+
+
+def _load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return None
+
+
+def _manifest_up_to_date(out_dir, manifest, previous, options):
+    if not previous:
+        return False
+    # 经过 Json 序列化后再比较 避免 tuple 与 list 之类的差异
+    keys = ('version', 'options', 'inputHash')
+    if json.dumps([previous.get(k) for k in keys], sort_keys=True) != \
+            json.dumps([manifest[k] for k in keys], sort_keys=True):
+        return False
+    return all(os.path.exists(os.path.join(out_dir, f)) for f in _dataset_outputs(options))
+
+
+def _json_to_dataset(filename, options=None, force=False):
+    '''
+    将一个 Json 文件转换为数据集 保存在同名的 _dataset 目录中
+
+    导出目录中的 manifest 记录了输入文件的哈希值、转换器版本、导出选项及导出的文件
+    前三者均未变化时跳过转换 未选择的文件会被删除
+    返回是否进行了转换 不是标注文件时返回 None 也不会创建导出目录
+    '''
+    options = exportOptions(options)
+    out_dir = os.path.join(os.path.splitext(filename)[0] + '_dataset')
+    previous = _load_manifest(out_dir)
+    manifest = _dataset_manifest(filename, options, previous)
+    if not force and _manifest_up_to_date(out_dir, manifest, previous, options):
+        # 内容未变但修改时间变化时 更新 manifest 下次不必再计算哈希值
+        if manifest['inputMtime'] != previous.get('inputMtime'):
+            with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+        return False
+
+    artifacts = options['artifacts']
+    compressLevel = options['compressLevel']
+    needImage = 'img' in artifacts or 'label_viz' in artifacts
+    if needImage:
+        with open(filename) as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            # 与 loadJsonInfo 一致 顶层不是对象时视为格式错误
+            raise ValueError('expected an object in json file')
+    else:
+        # 不需要图像时跳过 imageData 也不解码图像
+        data = loadJsonInfo(filename)
+    if not isLabelData(data):
+        return None
+    if needImage:
+        imageBytes = loadImageBytes(filename, data)
+        img = np.array(PIL.Image.open(io.BytesIO(imageBytes)))
+        imgShape = img.shape
+    elif data.get('imageHeight') and data.get('imageWidth'):
+        imgShape = (data['imageHeight'], data['imageWidth'])
+    else:
+        imgShape = loadImageArray(filename, loadJsonInfo(filename, skip=())).shape
+
+    if options['labelNames'] is not None:
+        # 使用所有文件共用的类别编号
+        label_name_to_value = {ln: lv for lv, ln in enumerate(options['labelNames'])}
+        unknown = set(s['label'] for s in data['shapes']) - set(label_name_to_value)
+        if unknown:
+            raise ValueError('labels not in label names: {}'.format(', '.join(sorted(unknown))))
+    else:
+        label_name_to_value = {BACKGROUND: 0}
+        for shape in data['shapes']:
+            label_name = shape['label']
+            label_value = label_name_to_value.get(label_name, len(label_name_to_value))
+            label_name_to_value[label_name] = label_value
 
     # label_values must be dense
     label_values, label_names = [], []
@@ -189,72 +846,136 @@ def _json_to_dataset(filename):
         label_names.append(ln)
     assert label_values == list(range(len(label_values)))
 
-    lbl = shapes_to_label(img.shape, data['shapes'], label_name_to_value)
-
-    captions = ['{}: {}'.format(lv, ln)
-                for ln, lv in label_name_to_value.items()]
+    # 类别数超过 256 时 所有分块都使用 int32 保证格式一致
+    labelFormat = options['labelFormat'] if len(label_name_to_value) <= 256 else 'int32'
+    tileSize = options['tileSize']
+    if not tileSize or 'label_viz' in artifacts:
+        lbl = shapes_to_label(imgShape, data['shapes'], label_name_to_value)
 
-    lbl_viz = draw_label(lbl, img, captions)
-
-    out_dir = os.path.join(os.path.splitext(filename)[0] + '_dataset')
     if not os.path.exists(out_dir):
         os.mkdir(out_dir)
-
-    PIL.Image.fromarray(img).save(os.path.join(out_dir, 'img.png'))
-    PIL.Image.fromarray(lbl).save(os.path.join(out_dir, 'label.png'))
-    PIL.Image.fromarray(lbl_viz).save(os.path.join(out_dir, 'label_viz.png'))
-
-    with open(os.path.join(out_dir, 'label_names.txt'), 'w') as f:
-        for lbl_name in label_names:
-            f.write(lbl_name + '\n')
-
+    else:
+        # 先删除旧的 manifest 转换中断时下次会重新转换
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(out_dir, MANIFEST))
+        # 删除之前导出、本次未选择的文件 它们可能与新的标注不一致
+        for name, file in ARTIFACTS.items():
+            if name not in artifacts:
+                with contextlib.suppress(OSError):
+                    os.remove(os.path.join(out_dir, file))
+        if 'label' not in artifacts:
+            shutil.rmtree(os.path.join(out_dir, TILES_DIR), ignore_errors=True)
+
+    if 'img' in artifacts:
+        if imageBytes.startswith(PNG_SIGNATURE):
+            # 原图即为 PNG 时直接写入原始字节 不必重新编码
+            with open(os.path.join(out_dir, 'img.png'), 'wb') as f:
+                f.write(imageBytes)
+        else:
+            PIL.Image.fromarray(img).save(os.path.join(out_dir, 'img.png'),
+                                          compress_level=compressLevel)
+    if 'label' in artifacts and tileSize:
+        _save_label_tiles(os.path.join(out_dir, TILES_DIR), imgShape, data['shapes'],
+                          label_name_to_value, tileSize, labelFormat, compressLevel)
+        # 删除之前未分块导出的标签图
+        with contextlib.suppress(OSError):
+            os.remove(os.path.join(out_dir, ARTIFACTS['label']))
+    elif 'label' in artifacts:
+        label_image(lbl, labelFormat).save(
+            os.path.join(out_dir, 'label.png'), compress_level=compressLevel)
+        shutil.rmtree(os.path.join(out_dir, TILES_DIR), ignore_errors=True)
+    if 'label_viz' in artifacts:
+        captions = ['{}: {}'.format(lv, ln)
+                    for ln, lv in label_name_to_value.items()]
+        lbl_viz = draw_label(lbl, img, captions)
+        PIL.Image.fromarray(lbl_viz).save(os.path.join(out_dir, 'label_viz.png'),
+                                          compress_level=compressLevel)
+
+    if 'label_names' in artifacts:
+        with open(os.path.join(out_dir, 'label_names.txt'), 'w') as f:
+            for lbl_name in label_names:
+                f.write(lbl_name + '\n')
+
+    if 'info' in artifacts:
         info = dict(label_names=label_names)
         with open(os.path.join(out_dir, 'info.yaml'), 'w') as f:
             yaml.safe_dump(info, f, default_flow_style=False)
 
-        return True
+    # 所有文件写入完成后再写入 manifest
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return True
 
 
-def polygons_to_mask(img_shape, polygons, isCircleArea):
-    mask = np.zeros(img_shape[:2], dtype=np.uint8)
-    mask = PIL.Image.fromarray(mask)
-    xy = list(map(tuple, polygons))
+def shape_to_polygon(shape):
+    '''
+    将标注区域转换为 PIL 绘制时使用的坐标
+    返回 (xy, isCircleArea)
+     - 矩形: 按顺序排列的四个顶点
+     - 圆形: 外接矩形的两个顶点
+     - 多边形: 所有顶点
+    不会修改 shape 本身
+    '''
+    points = [tuple(p) for p in shape['points']]
+    shape_type = shape.get('shape_type', 'polygon')
+
+    # 增加对于矩形区域的适配
+    if shape_type == 'rectangle':
+        pt1, pt2 = points[0], points[1]
+
+        # 需要保证有序
+        return [pt1, (pt1[0], pt2[1]), pt2, (pt2[0], pt1[1])], False
+
+    # 增加对于圆形区域的适配
+    elif shape_type == 'circle':
+        center, p = points[0], points[1]
+        r = abs(center[0] - p[0])
+        x = center[0] - r if center[0] < p[0] else center[0] + r
+        y = center[1] - r if center[1] < p[1] else center[1] + r
+        (x1, x2), (y1, y2) = sorted((x, p[0])), sorted((y, p[1]))
+        return [(x1, y1), (x2, y2)], True
+
+    return points, False
+
+
+def draw_shape(draw, xy, isCircleArea, value):
+    '''
+    使用 PIL.ImageDraw 以 value 填充一个标注区域
+    PIL 只会扫描区域的外接矩形 耗时与区域面积成正比
+    '''
     if isCircleArea:
         # 对于圆形区域
-        # 传入的参数为外接矩形的四个点坐标
-        PIL.ImageDraw.Draw(mask).ellipse(xy=xy, outline=1, fill=1)
+        # 传入的参数为外接矩形的两个点坐标
+        draw.ellipse(xy=xy, outline=value, fill=value)
     else:
-        PIL.ImageDraw.Draw(mask).polygon(xy=xy, outline=1, fill=1)  # 完成点的连接
+        draw.polygon(xy=xy, outline=value, fill=value)  # 完成点的连接
+
+
+def polygons_to_mask(img_shape, polygons, isCircleArea):
+    mask = PIL.Image.new('1', (img_shape[1], img_shape[0]), 0)
+    draw_shape(PIL.ImageDraw.Draw(mask), list(map(tuple, polygons)), isCircleArea, 1)
     mask = np.array(mask, dtype=bool)
     return mask
 
 
 def shapes_to_label(img_shape, shapes, label_name_to_value, type='class'):
+    '''
+    将所有标注区域绘制到同一张标签图中
+    后绘制的区域覆盖先绘制的区域
+
+    只分配一张 (实例模式下为两张) 与图像等大的标签图
+    不会为每个区域单独生成掩模
+    '''
     assert type in ['class', 'instance']
 
-    cls = np.zeros(img_shape[:2], dtype=np.int32)
+    size = (img_shape[1], img_shape[0])
+    cls = PIL.Image.new('I', size, 0)
+    draw_cls = PIL.ImageDraw.Draw(cls)
     if type == 'instance':
-        ins = np.zeros(img_shape[:2], dtype=np.int32)
+        ins = PIL.Image.new('I', size, 0)
+        draw_ins = PIL.ImageDraw.Draw(ins)
         instance_names = ['_background_']
     for shape in shapes:
-        polygons = shape['points']
-
-        # 增加对于矩形区域的适配
-        if shape['shape_type'] == 'rectangle':
-            pt1, pt2 = polygons[0], polygons[1]
-
-            # 需要保证有序
-            polygons.insert(1, [pt1[0], pt2[1]])
-            polygons.append([pt2[0], pt1[1]])
-
-        # 增加对于圆形区域的适配
-        elif shape['shape_type'] == 'circle':
-            center, p = polygons[0], polygons[1]
-            r = abs(center[0] - p[0])
-            x = center[0] - r if center[0] < p[0] else center[0] + r
-            y = center[1] - r if center[1] < p[1] else center[1] + r
-            polygons[0] = [x, y]
-
         label = shape['label']
         if type == 'class':
             cls_name = label
@@ -265,100 +986,211 @@ def shapes_to_label(img_shape, shapes, label_name_to_value, type='class'):
             ins_id = len(instance_names) - 1
         cls_id = label_name_to_value[cls_name]
 
-        if shape['shape_type'] == 'circle':
-            mask = polygons_to_mask(img_shape[:2], polygons, True)
-        else:
-            mask = polygons_to_mask(img_shape[:2], polygons, False)
-        cls[mask] = cls_id
+        xy, isCircleArea = shape_to_polygon(shape)
+        draw_shape(draw_cls, xy, isCircleArea, cls_id)
         if type == 'instance':
-            ins[mask] = ins_id
+            draw_shape(draw_ins, xy, isCircleArea, ins_id)
 
+    cls = np.array(cls, dtype=np.int32)
     if type == 'instance':
-        return cls, ins
+        return cls, np.array(ins, dtype=np.int32)
     return cls
 
 
+def shapes_to_label_tiles(img_shape, shapes, label_name_to_value, tile_size=1024):
+    '''
+    分块绘制标签图 按行依次返回 (row, col, tile)
+    tile 为 int32 数组 右侧及下方边缘的分块小于 tile_size
+
+    先按外接矩形将标注区域分配到与之相交的分块中
+    每个分块只绘制与之相交的区域 结果与 shapes_to_label 一致
+    (PIL 填充多边形时的浮点舍入与坐标原点有关 偶尔会有个别边缘像素不同)
+    内存占用只与分块大小有关 与图像尺寸无关
+    '''
+    height, width = img_shape[:2]
+    rows = (height + tile_size - 1) // tile_size
+    cols = (width + tile_size - 1) // tile_size
+
+    # (row, col) -> [(xy, isCircleArea, cls_id), ...] 保持绘制顺序
+    tiles = {}
+    for shape in shapes:
+        cls_id = label_name_to_value[shape['label']]
+        xy, isCircleArea = shape_to_polygon(shape)
+        if not xy:
+            continue
+        # PIL 绘制前会将坐标向零取整 平移到分块坐标系之前先取整
+        # 否则在分块中变为负数的坐标取整方向不同 结果与整张绘制时不一致
+        xy = [(int(x), int(y)) for x, y in xy]
+        xs = [p[0] for p in xy]
+        ys = [p[1] for p in xy]
+        # 边界向外扩展一个像素 包括轮廓线
+        row0 = max(0, min(ys) - 1) // tile_size
+        row1 = min(rows - 1, (max(ys) + 1) // tile_size)
+        col0 = max(0, min(xs) - 1) // tile_size
+        col1 = min(cols - 1, (max(xs) + 1) // tile_size)
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                tiles.setdefault((row, col), []).append((xy, isCircleArea, cls_id))
+
+    for row in range(rows):
+        for col in range(cols):
+            y0, x0 = row * tile_size, col * tile_size
+            tile = PIL.Image.new('I', (min(tile_size, width - x0), min(tile_size, height - y0)), 0)
+            items = tiles.pop((row, col), None)
+            if items:
+                draw = PIL.ImageDraw.Draw(tile)
+                for xy, isCircleArea, cls_id in items:
+                    draw_shape(draw, [(x - x0, y - y0) for x, y in xy], isCircleArea, cls_id)
+            yield row, col, np.array(tile, dtype=np.int32)
+
+
+# 缓存的 uint8 调色板 (N x 3) 由 label_colormap_lut 生成
+_colormap_lut = None
+
+
+def label_colormap_lut(N=256):
+    '''
+    返回 N 个类别的 uint8 调色板 (N x 3 只读数组)
+
+    首次调用时使用向量化运算生成至少 256 个颜色并缓存
+    之后的调用直接返回缓存的切片
+    标签图上色只需 lut[lbl] 一次索引
+    '''
+    global _colormap_lut
+    if _colormap_lut is None or len(_colormap_lut) < N:
+        ids = np.arange(max(N, 256))
+        cmap = np.zeros((len(ids), 3), dtype=np.uint8)
+        for j in range(8):
+            for c in range(3):
+                cmap[:, c] |= (((ids >> (3 * j + c)) & 1) << (7 - j)).astype(np.uint8)
+        cmap.setflags(write=False)
+        _colormap_lut = cmap
+    return _colormap_lut[:N]
+
+
 def label_colormap(N=256):
+    '''
+    取值范围为 [0, 1] 的 float32 调色板
+    '''
+    return label_colormap_lut(N).astype(np.float32) / 255
 
-    def bitget(byteval, idx):
-        return ((byteval & (1 << idx)) != 0)
-
-    cmap = np.zeros((N, 3))
-    for i in range(0, N):
-        id = i
-        r, g, b = 0, 0, 0
-        for j in range(0, 8):
-            r = np.bitwise_or(r, (bitget(id, 0) << 7 - j))
-            g = np.bitwise_or(g, (bitget(id, 1) << 7 - j))
-            b = np.bitwise_or(b, (bitget(id, 2) << 7 - j))
-            id = (id >> 3)
-        cmap[i, 0] = r
-        cmap[i, 1] = g
-        cmap[i, 2] = b
-    cmap = cmap.astype(np.float32) / 255
-    return cmap
 
 # similar function as skimage.color.label2rgb
 
 
-def label2rgb(lbl, img=None, n_labels=None, alpha=0.3, thresh_suppress=0):
+def label2rgb(lbl, img=None, n_labels=None, alpha=0.3, thresh_suppress=0, out=None):
+    '''
+    将标签图上色 给出 img 时与其灰度图按 alpha 混合
+
+    使用 8 位定点数进行混合 (a * lbl + (256 - a) * gray) >> 8
+    按行分块处理 临时数组的大小与图像尺寸无关 不会生成 float64 数组
+    out 为 HxWx3 的 uint8 数组时直接写入其中 可以是 img 本身
+    '''
     if n_labels is None:
         n_labels = len(np.unique(lbl))
 
-    cmap = label_colormap(n_labels)
-    cmap = (cmap * 255).astype(np.uint8)
-
-    lbl_viz = cmap[lbl]
-    lbl_viz[lbl == -1] = (0, 0, 0)  # unlabeled
+    # 最后一行为黑色 lbl 为 -1 (未标注) 时取到该行
+    cmap = np.zeros((n_labels + 1, 3), dtype=np.uint16)
+    cmap[:n_labels] = label_colormap_lut(n_labels)
+    if out is None:
+        out = np.empty(lbl.shape + (3,), dtype=np.uint8)
 
-    if img is not None:
-        img_gray = PIL.Image.fromarray(img).convert('LA')
-        img_gray = np.asarray(img_gray.convert('RGB'))
-        lbl_viz = alpha * lbl_viz + (1 - alpha) * img_gray
-        lbl_viz = lbl_viz.astype(np.uint8)
-
-    return lbl_viz
+    if img is None:
+        cmap = cmap.astype(np.uint8)
+    else:
+        a = int(round(alpha * 256))
+        cmap *= a
+        gray = np.asarray(PIL.Image.fromarray(img).convert('L'))
+
+    # 每次处理约 2^20 个像素
+    step = max(1, (1 << 20) // max(1, lbl.shape[1]))
+    for y in range(0, lbl.shape[0], step):
+        rows = slice(y, y + step)
+        if img is None:
+            np.take(cmap, lbl[rows], axis=0, out=out[rows])
+            continue
+        g = gray[rows].astype(np.uint16)
+        g *= 256 - a
+        buf = np.empty_like(g)
+        for c in range(3):
+            np.take(cmap[:, c], lbl[rows], out=buf)
+            buf += g
+            buf >>= 8
+            out[rows, :, c] = buf
 
+    return out
 
-def draw_label(label, img, label_names, colormap=None):
-    import matplotlib.pyplot as plt
-    backend_org = plt.rcParams['backend']
-    plt.switch_backend('agg')
 
-    plt.subplots_adjust(left=0, right=1, top=1, bottom=0,
-                        wspace=0, hspace=0)
-    plt.margins(0, 0)
-    plt.gca().xaxis.set_major_locator(plt.NullLocator())
-    plt.gca().yaxis.set_major_locator(plt.NullLocator())
+@functools.lru_cache(maxsize=8)
+def _legend_font(size):
+    '''
+    图例使用的字体
+    '''
+    try:
+        return PIL.ImageFont.load_default(size=size)   # Pillow >= 10.1
+    except TypeError:
+        pass
+    try:
+        return PIL.ImageFont.truetype('DejaVuSans.ttf', size)
+    except IOError:
+        return PIL.ImageFont.load_default()
 
-    if colormap is None:
-        colormap = label_colormap(len(label_names))
 
-    label_viz = label2rgb(label, img, n_labels=len(label_names))
-    plt.imshow(label_viz)
-    plt.axis('off')
+def _text_size(draw, text, font):
+    if hasattr(draw, 'textbbox'):
+        x1, y1, x2, y2 = draw.textbbox((0, 0), text, font=font)
+        return x2, y2
+    return draw.textsize(text, font=font)
 
-    plt_handlers = []
-    plt_titles = []
-    for label_value, label_name in enumerate(label_names):
-        if label_value not in label:
-            continue
-        if label_name.startswith('_'):
-            continue
-        fc = colormap[label_value]
-        p = plt.Rectangle((0, 0), 1, 1, fc=fc)
-        plt_handlers.append(p)
-        plt_titles.append(label_name)
-    plt.legend(plt_handlers, plt_titles, loc='lower right', framealpha=.5)
 
-    f = io.BytesIO()
-    plt.savefig(f, bbox_inches='tight', pad_inches=0)
-    plt.cla()
-    plt.close()
+def draw_label(label, img, label_names, colormap=None):
+    '''
+    在图像上叠加标注区域 并在右下角绘制图例
 
-    plt.switch_backend(backend_org)
+    直接使用 PIL 在原分辨率下绘制
+    不依赖 matplotlib 可以在多个进程中同时调用
+    '''
+    if colormap is None:
+        colormap = label_colormap_lut(len(label_names))
+    else:
+        colormap = np.round(np.asarray(colormap) * 255).astype(np.uint8)
 
-    out_size = (img.shape[1], img.shape[0])
-    out = PIL.Image.open(f).resize(out_size, PIL.Image.BILINEAR).convert('RGB')
-    out = np.asarray(out)
-    return out
+    label_viz = label2rgb(label, img, n_labels=len(label_names))
+    out = PIL.Image.fromarray(label_viz)
+
+    # 图例中只包括图像中出现的标签
+    present = np.bincount(label[label >= 0].ravel(), minlength=len(label_names))
+    entries = [(name, tuple(colormap[value][:3].tolist()))
+               for value, name in enumerate(label_names)
+               if present[value] and not name.startswith('_')]
+    if not entries:
+        return np.asarray(out)
+
+    # 字号与图像尺寸成比例
+    size = max(10, int(min(out.size) / 40))
+    font = _legend_font(size)
+    draw = PIL.ImageDraw.Draw(out)
+    pad = size // 2
+    line_height = int(size * 1.4)
+    patch_w, patch_h = 2 * size, int(size * 0.7)
+    text_w = max(_text_size(draw, name, font)[0] for name, _ in entries)
+    box_w = pad * 3 + patch_w + text_w
+    box_h = pad * 2 + line_height * len(entries)
+    x0 = max(0, out.size[0] - box_w - pad)
+    y0 = max(0, out.size[1] - box_h - pad)
+
+    # 半透明的白色背景 只对图例所在区域进行混合
+    region = (x0, y0, min(out.size[0], x0 + box_w), min(out.size[1], y0 + box_h))
+    box = out.crop(region)
+    box = PIL.Image.blend(box, PIL.Image.new('RGB', box.size, (255, 255, 255)), 0.5)
+    out.paste(box, region[:2])
+    draw.rectangle(region, outline=(204, 204, 204))
+
+    for i, (name, color) in enumerate(entries):
+        y = y0 + pad + i * line_height
+        py = y + (line_height - patch_h) // 2
+        draw.rectangle((x0 + pad, py, x0 + pad + patch_w, py + patch_h), fill=color)
+        draw.text((x0 + pad * 2 + patch_w, y + (line_height - size) // 2),
+                  name, fill=(0, 0, 0), font=font)
+
+    return np.asarray(out)
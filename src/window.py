@@ -1,14 +1,39 @@
 from ui_mainwindow import Ui_MainWindow
-from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QListWidgetItem
+from PyQt5.QtWidgets import QMainWindow, QFileDialog, QMessageBox, QListWidgetItem, QAction, QLabel, \
+    QInputDialog, QProgressDialog, QApplication
 from PyQt5.QtGui import QImageReader, QPixmap
-from PyQt5.QtCore import Qt, QFile
+from PyQt5.QtCore import Qt, QFile, pyqtSignal
 import os
+import sqlite3
+import threading
 
 from enum import Enum
 from zoomSpinBox import zoomSpinBox
 from label_dialog import LabelDialog
 from widget_author_info import AuthorWidget
-from tools import getImageData, saveJsonFile, loadJsonFile, json_to_dataset
+from save_queue import SaveQueue
+from journal import Journal
+from label_binary import loadBinaryFile
+from project_index import ProjectIndex
+from tools import saveLabelFile, loadJsonInfo, formatShapes, iter_json_to_dataset, \
+    getJsonImagePath, loadProjectConfig, saveProjectConfig, exportOptions, scan_label_names, \
+    PROJECT_CONFIG, NOT_LABEL_FILE
+
+# 日志中累积的记录数达到该值时 在后台合并进标注文件
+JOURNAL_COMPACT_OPS = 50
+
+
+def formatShape(s):
+    '''
+    将shape转换为json格式中的内容
+
+    包括label、构成区域的所有点以及区域形状
+    '''
+    return dict(
+        label=s.label,
+        points=s.coords.tolist(),
+        shape_type=s.shape_type,
+    )
 
 
 class zoomMode(Enum):
@@ -18,6 +43,7 @@ class zoomMode(Enum):
 
 
 class MainWindow(QMainWindow, Ui_MainWindow):
+    indexRebuilt = pyqtSignal(object, str)  # 后台建立索引完成 (索引, 错误信息)
 
     def __init__(self, parent=None):
         super(MainWindow, self).__init__(parent)
@@ -27,6 +53,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.filename = ''      # 记录当前正在处理图像的文件名
         self.image = None       # 记录当前正在处理的源图像 类型为QImage
         self.zoomMode = zoomMode.FIT_WINDOW
+        self.projectDir = ''    # 当前工程目录 工程配置保存在该目录下
+        self.projectConfig = loadProjectConfig('.')
+        self.journal = None     # 当前标注文件的修改日志 仅在自动保存模式下使用
+        self.projectIndex = None    # 打开文件夹时建立的标注文件索引
+        self.indexThread = None     # 在后台建立索引的线程
+        self.indexCancel = None     # 用于取消后台建立索引的 threading.Event
         self.initAction()
 
         # 保存label与shape之间的对应关系
@@ -93,6 +125,23 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         # Tools子菜单
         self.actionconvert_to_dataset.triggered.connect(
             self.json2Dataset)  # 转换 Json 文件
+        self.actionEmbed_Image_Data.toggled.connect(
+            self.toggleEmbedImageData)  # 切换嵌入/引用模式
+        self.actionAutosave.toggled.connect(
+            self.toggleAutosave)    # 切换自动保存
+        self.actionScan_Labels.toggled.connect(
+            self.toggleScanLabels)  # 切换统一的类别编号
+        self.actionFilter_By_Label.triggered.connect(
+            self.filterByLabel)     # 按标签筛选图像
+        self.actionLabel_Statistics.triggered.connect(
+            self.showLabelStatistics)   # 标签统计
+
+        # 后台保存队列的状态
+        self.saveQueue.saving.connect(
+            lambda filename: self.label_save_status.setText('saving…'))
+        self.saveQueue.saved.connect(self.labelSaved)
+        self.saveQueue.failed.connect(self.labelSaveFailed)
+        self.indexRebuilt.connect(self.projectIndexRebuilt)
 
         # Help 子菜单
         self.actionAbout.triggered.connect(self.showAuthorInfo)  # Emmm
@@ -101,7 +150,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.canvas.newShape.connect(self.newShape)
         self.canvas.paintingShape.connect(self.toggleDrawingSensitive)
         self.canvas.selectionChanged.connect(self.shapeSelectionChanged)
-        self.canvas.shapeMoved.connect(self.setDirty)
+        self.canvas.shapeMoved.connect(self.shapesMoved)
         self.canvas.scrollRequest.connect(
             self.scrollRequest)   # canvas的滚动请求转发到此进行处理
         self.canvas.zoomRequest.connect(self.zoomRequest)  # canvas的放缩请求
@@ -151,6 +200,40 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.setCentralWidget(self.centralwidget)
         self.spinbox_scale = zoomSpinBox()
         self.toolBar.insertWidget(self.actionZoom_out, self.spinbox_scale)
+
+        # 是否在 Json 文件中嵌入图像数据
+        # 关闭时 Json 文件只记录图像的相对路径、尺寸及哈希值
+        self.actionEmbed_Image_Data = QAction('embed image data', self)
+        self.actionEmbed_Image_Data.setCheckable(True)
+        self.actionEmbed_Image_Data.setChecked(True)
+        self.menuSettings.addAction(self.actionEmbed_Image_Data)
+
+        # 自动保存
+        # 每次修改追加到日志文件中 并定期合并进标注文件
+        self.actionAutosave = QAction('autosave edits', self)
+        self.actionAutosave.setCheckable(True)
+        self.menuSettings.addAction(self.actionAutosave)
+
+        # 转换数据集时 所有文件使用相同的类别编号
+        self.actionScan_Labels = QAction('consistent class ids', self)
+        self.actionScan_Labels.setCheckable(True)
+        self.menuSettings.addAction(self.actionScan_Labels)
+
+        # 基于工程索引的筛选及统计
+        self.menuSettings.addSeparator()
+        self.actionFilter_By_Label = QAction('filter by label', self)
+        self.actionFilter_By_Label.setEnabled(False)
+        self.menuSettings.addAction(self.actionFilter_By_Label)
+        self.actionLabel_Statistics = QAction('label statistics', self)
+        self.actionLabel_Statistics.setEnabled(False)
+        self.menuSettings.addAction(self.actionLabel_Statistics)
+
+        # 标注文件在后台线程中保存
+        # 状态栏右侧显示保存状态
+        self.saveQueue = SaveQueue(parent=self)
+        self.label_save_status = QLabel()
+        self.statusbar.addPermanentWidget(self.label_save_status)
+
         self.zoomMode = zoomMode.FIT_WIDTH
         self.initSignal()
         self.authorInfo = AuthorWidget()
@@ -171,6 +254,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             if isinstance(filename, (tuple, list)):
                 filename = filename[0]
             self.listWidget_files.clear()
+            self.loadProject(os.path.dirname(str(filename)))
             self.loadFile(str(filename))
 
     def openDir(self):
@@ -187,6 +271,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             return
         self.filename = ''
         self.listWidget_files.clear()
+        self.loadProject(filepath)
 
         def scanImages(filepath):
             extensions = ['.%s' % fmt.data().decode("ascii").lower()
@@ -211,6 +296,106 @@ class MainWindow(QMainWindow, Ui_MainWindow):
 
         self.filename = self.imageList[0] if self.imageList else ''
 
+        # 建立/更新该目录下所有标注文件的索引
+        # 先等待后台保存完成 索引中不会记录保存之前的内容
+        self.statusbar.showMessage('indexing {}'.format(filepath))
+        self.saveQueue.join()
+        try:
+            index = self.projectIndex = ProjectIndex(filepath)
+        except sqlite3.Error as e:
+            # 例如只读目录 此时不能按标签筛选及统计 但仍可以标注
+            self.statusbar.showMessage('indexing disabled: {}'.format(e))
+            return
+        workers = self.projectConfig['workers']
+        cancel = self.indexCancel = threading.Event()
+
+        def rebuild():
+            # 在后台线程中扫描 不阻塞界面
+            try:
+                index.rebuild(workers, cancel=cancel)
+            except Exception as e:
+                self.indexRebuilt.emit(index, str(e))
+            else:
+                self.indexRebuilt.emit(index, '')
+
+        self.indexThread = threading.Thread(target=rebuild, daemon=True)
+        self.indexThread.start()
+
+    def projectIndexRebuilt(self, index, error):
+        '''
+        槽函数
+        后台建立索引完成后 启用按标签筛选及统计
+        '''
+        if index is not self.projectIndex:
+            # 已经打开了其他文件夹
+            return
+        if error:
+            self.statusbar.showMessage('indexing failed: {}'.format(error))
+            return
+        self.actionFilter_By_Label.setEnabled(True)
+        self.actionLabel_Statistics.setEnabled(True)
+        self.statusbar.showMessage('{}'.format(index.dirname))
+
+    def waitIndexThread(self):
+        '''
+        取消后台建立索引 并等待线程结束
+        '''
+        if self.indexThread:
+            self.indexCancel.set()
+            self.indexThread.join()
+            self.indexThread = None
+
+    def loadProject(self, dirname):
+        '''
+        读取工程目录下的配置
+        '''
+        if self.projectIndex:
+            self.saveQueue.join()
+            self.waitIndexThread()
+            self.projectIndex.close()
+            self.projectIndex = None
+            self.actionFilter_By_Label.setEnabled(False)
+            self.actionLabel_Statistics.setEnabled(False)
+        self.projectDir = dirname
+        self.projectConfig = loadProjectConfig(dirname)
+        self.actionEmbed_Image_Data.setChecked(
+            self.projectConfig['embedImageData'])
+        self.actionAutosave.setChecked(self.projectConfig['autosave'])
+        self.actionScan_Labels.setChecked(self.projectConfig['scanLabels'])
+
+    def toggleEmbedImageData(self, checked):
+        '''
+        槽函数
+        切换 Json 文件的保存模式 并写入工程配置
+        '''
+        if self.projectConfig['embedImageData'] == checked:
+            return
+        self.projectConfig['embedImageData'] = checked
+        if self.projectDir:
+            saveProjectConfig(self.projectDir, self.projectConfig)
+
+    def toggleAutosave(self, checked):
+        '''
+        槽函数
+        切换自动保存 并写入工程配置
+        '''
+        if self.projectConfig['autosave'] == checked:
+            return
+        self.projectConfig['autosave'] = checked
+        if self.projectDir:
+            saveProjectConfig(self.projectDir, self.projectConfig)
+
+    def toggleScanLabels(self, checked):
+        '''
+        槽函数
+        切换转换数据集时是否使用统一的类别编号 并写入工程配置
+        '''
+        if self.projectConfig['scanLabels'] == checked:
+            return
+        self.projectConfig['scanLabels'] = checked
+        if self.projectDir:
+            saveProjectConfig(self.projectDir, self.projectConfig)
+
     def loadFile(self, filename=None):
         '''
         根据文件名加载文件
@@ -224,6 +409,15 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.listWidget_files.repaint()
             return
 
+        # 假设该图像已经被标记
+        # 那么应该存在同名 Json 文件
+        label_file = os.path.splitext(filename)[0] + '.json'
+
+        # 直接打开 Json 文件时 根据 imagePath 找到对应的图像
+        if filename.lower().endswith('.json'):
+            label_file = filename
+            filename = getJsonImagePath(label_file)
+
         self.statusbar.showMessage('opening {}'.format(filename))
         self.resetState()
         self.canvas.setEnabled(False)
@@ -237,24 +431,39 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self.statusbar.showMessage('Error loading {}'.format(filename))
             return
 
-        # 假设该图像已经被标记
-        # 那么应该存在同名 Json 文件
-        label_file = os.path.splitext(filename)[0] + '.json'
-
         # 如果存在同名 Json文件
         # TODO: 进行 Json 合法性检查 这里直接忽略了
+        binary_file = os.path.splitext(label_file)[0] + '.lbin'
+        # 该文件可能还在后台保存 等待保存完成后再读取
+        self.saveQueue.wait(label_file)
         if QFile.exists(label_file):
             # 从 Json 文件中提取标注区域信息
-            shapes = loadJsonFile(label_file)
-
+            data = loadJsonInfo(label_file)
+        elif QFile.exists(binary_file):
+            # 只有二进制格式的标注文件
+            # 之后的修改仍然保存为 Json 格式
+            # points 为内存映射的顶点数组的视图 加载时直接拼接到 canvas 的 store 中
+            data = loadBinaryFile(binary_file)
+        else:
+            data = dict(shapes=[])
+
+        # 自动保存模式下 重放日志中尚未合并的修改
+        if self.projectConfig['autosave']:
+            self.journal = Journal(label_file)
+            self.journal.replay(data['shapes'], data.get('journalSeq', 0))
+            if self.journal.error:
+                # 日志与标注文件不一致 只恢复了之前的修改
+                QMessageBox.warning(self, 'Journal',
+                                    'Some unsaved changes of {} could not be restored:\n{}'.format(
+                                        label_file, self.journal.error))
+
+        if data['shapes']:
             # 交给 canvas 类处理
-            self.canvas.retrieveAndLoadShape(shapes)
+            self.canvas.retrieveAndLoadShape(formatShapes(data['shapes']))
 
             # 更新右侧的label列表
-            # labels 记录所有的标注信息
-            # Python Set 用于去重
-            labels = list(shape.label for shape in self.canvas.shapes)
-            for label in set(labels):
+            # labelCounts 中的标签已经去重 按出现的顺序排列
+            for label in self.canvas.store.labelCounts():
                 self.listWidget_labels.addItem(label)
 
             # 更新 itemToShapes 字典
@@ -274,6 +483,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.actionCreate_Rectangle.setEnabled(True)
         self.actionCreate_Circle.setEnabled(True)
 
+        # 将恢复出的修改合并进标注文件
+        if self.journal and self.journal.count:
+            self.saveLabels(self.journal.labelFile)
+
     def closeFile(self):
         if not self.leaving():
             return
@@ -284,6 +497,27 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.dirty = True
         self.actionSave.setEnabled(True)
 
+    def shapesMoved(self, shapes):
+        '''
+        槽函数
+        canvas 中的图形被拖动后触发
+        '''
+        for shape in shapes:
+            self.journalAppend('move', index=self.canvas.shapes.index(shape),
+                               points=formatShape(shape)['points'])
+        self.setDirty()
+
+    def journalAppend(self, op, **kwargs):
+        '''
+        自动保存模式下 将一次修改追加到日志中
+        记录数较多时 在后台合并进标注文件
+        '''
+        if not self.journal:
+            return
+        self.journal.append(op, **kwargs)
+        if self.journal.count >= JOURNAL_COMPACT_OPS:
+            self.saveLabels(self.journal.labelFile)
+
     def computeScale(self, image):
         if self.zoomMode == zoomMode.FIT_WINDOW:
             e = 2.0
@@ -310,7 +544,13 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         '''
         在切换任务前检查是否有未保存的修改
         如果有 弹出对话框进行询问
+        自动保存模式下 直接将日志合并进标注文件
         '''
+        if self.journal:
+            if self.journal.count:
+                self.saveLabels(self.journal.labelFile)
+            self.setClean()
+            return True
         if not self.dirty:
             return True
         mb = QMessageBox
@@ -333,6 +573,9 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         self.listWidget_labels.clear()
         self.filename = ''
         self.canvas.resetState()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
 
     def fileSelectionChanged(self):
         '''
@@ -412,6 +655,7 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             label = label_dialog.lineEdit.text()
             self.canvas.setLastLabel(label)
             self.addLabel(self.canvas.shapes[-1])
+            self.journalAppend('add', **formatShape(self.canvas.shapes[-1]))
             self.setDirty()
         else:
             self.canvas.undoLastLine()
@@ -430,7 +674,12 @@ class MainWindow(QMainWindow, Ui_MainWindow):
               'proceed anyway?'.format(len(self.canvas.selectedShapes))
         result = mb.warning(self, 'Attention', msg, mb.Yes | mb.No)
         if result == mb.Yes:
+            # 从后往前删除 保证日志中的序号在重放时依然有效
+            indices = sorted((self.canvas.shapes.index(s)
+                              for s in self.canvas.selectedShapes), reverse=True)
             deleted_shapes = self.canvas.deleteSelected()
+            for index in indices:
+                self.journalAppend('delete', index=index)
             for shape in deleted_shapes:
                 # 更新内部字典
                 self.itemToShapes[shape.label].remove(shape)
@@ -451,7 +700,10 @@ class MainWindow(QMainWindow, Ui_MainWindow):
         槽函数
         复制某个标注区域
         '''
+        count = len(self.canvas.selectedShapes)
         self.canvas.copySelectedShapes()
+        for shape in self.canvas.shapes[len(self.canvas.shapes) - count:]:
+            self.journalAppend('add', **formatShape(shape))
         self.setDirty()
 
     def saveFile(self, silentSave=False):
@@ -508,32 +760,69 @@ class MainWindow(QMainWindow, Ui_MainWindow):
     def saveLabels(self, filename):
         assert filename
 
-        def format_shape(s):
-            '''
-            将shape转换为json格式中的内容
-
-            包括label、构成区域的所有点以及区域形状
-            '''
-            return dict(
-                label=s.label,
-                points=[(p.x(), p.y()) for p in s.points],
-                shape_type=s.shape_type,
-            )
-
         # 标注信息
-        shapes = [format_shape(shape) for shape in self.canvas.shapes]
-
-        # 图像路径
-        imagePath = self.filename
+        # 在界面线程中生成快照 之后的修改不会影响本次保存
+        shapes = self.canvas.store.toJson()
+        imageFile = self.filename
+        height, width = self.image.height(), self.image.width()
+        embedImageData = self.projectConfig['embedImageData']
+
+        # 保存当前日志文件对应的标注文件时
+        # 记录已经合并的最后一条日志 保存完成后丢弃这些日志
+        journal = self.journal if self.journal and \
+            os.path.abspath(self.journal.labelFile) == os.path.abspath(filename) else None
+        extra = dict(journalSeq=journal.seq) if journal else {}
+
+        index = self.projectIndex
+
+        def job():
+            imageHash = saveLabelFile(filename, shapes, imageFile, height, width,
+                                      embedImageData, **extra)
+            if journal:
+                journal.truncate(extra['journalSeq'])
+            else:
+                # 不使用日志保存时 之前遗留的日志已经过时 重放会破坏新的内容
+                Journal(filename).discard()
+            if index:
+                # 索引只是缓存 更新失败不影响已经保存的标注文件
+                # 下次建立索引时会根据修改时间重新读取该文件
+                try:
+                    index.update(filename, shapes, imageFile, width, height, imageHash)
+                except (sqlite3.Error, OSError):
+                    pass
+
+        # 交给后台线程保存
+        self.label_save_status.setText('saving…')
+        self.saveQueue.put(filename, job)
+
+    def labelSaved(self, filename):
+        '''
+        槽函数
+        后台保存完成
+        '''
+        if self.saveQueue.isIdle():
+            self.label_save_status.setText('saved')
 
-        # 获得源图像的base64编码
-        imageData = getImageData(imagePath)
-        if os.path.dirname(filename) and not os.path.exists(os.path.dirname(filename)):
-            os.makedirs(os.path.dirname(filename))
+    def labelSaveFailed(self, filename, message):
+        '''
+        槽函数
+        后台保存失败
+        '''
+        self.label_save_status.setText('save failed')
+        QMessageBox.warning(self, 'Save failed',
+                            'Failed to save {}\n\n{}'.format(filename, message))
 
-        # 保存为 Json 格式
-        saveJsonFile(filename, shapes, imagePath, imageData,
-                     self.image.height(), self.image.width())
+    # @Overrides(QMainWindow)
+    def closeEvent(self, event):
+        '''
+        关闭窗口前等待所有保存任务完成
+        '''
+        if not self.leaving():
+            event.ignore()
+            return
+        self.saveQueue.join()
+        self.waitIndexThread()
+        event.accept()
 
     def addLabel(self, shape):
         item = QListWidgetItem(shape.label)
@@ -575,6 +864,40 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             shape.hovered = True
             self.canvas.repaint()
 
+    def filterByLabel(self):
+        '''
+        槽函数
+        文件列表中只显示包含指定标签的图像
+        '''
+        allLabels = '(all)'
+        label, ok = QInputDialog.getItem(
+            self, 'Filter by label', 'Label:',
+            [allLabels] + self.projectIndex.labels(), 0, False)
+        if not ok:
+            return
+
+        if label != allLabels:
+            labelFiles = set(self.projectIndex.labelFilesWithLabel(label))
+        for i in range(self.listWidget_files.count()):
+            item = self.listWidget_files.item(i)
+            if label == allLabels:
+                item.setHidden(False)
+                continue
+            labelFile = os.path.splitext(item.text())[0] + '.json'
+            item.setHidden(os.path.relpath(
+                labelFile, self.projectIndex.dirname) not in labelFiles)
+
+    def showLabelStatistics(self):
+        '''
+        槽函数
+        显示工程中每个标签的标注区域数及图像数
+        '''
+        lines = ['{}: {} shapes in {} images'.format(*row)
+                 for row in self.projectIndex.labelStatistics()]
+        QMessageBox.information(self, 'Label statistics',
+                                '\n'.join(lines) or 'No labels',
+                                QMessageBox.Ok, QMessageBox.Ok)
+
     def showAuthorInfo(self):
         '''
         槽函数
@@ -683,12 +1006,68 @@ class MainWindow(QMainWindow, Ui_MainWindow):
             self, caption,
             path, filters)
 
-        if filename:
-            result = json_to_dataset(filename)
-
-            mb = QMessageBox
-            title = 'Convert end'
-            content = 'Conversion end.\n\n{} successed\n{} failed'.format(
-                result[0], result[1])
-            mb.information(self, title, content,
-                           QMessageBox.Ok, QMessageBox.Ok)
+        if not filename:
+            return
+        # 等待后台保存完成 转换时读取的是最新的标注文件
+        self.saveQueue.join()
+
+        # 导出选项记录在工程配置中
+        try:
+            options = exportOptions(self.projectConfig['export'])
+        except ValueError as e:
+            QMessageBox.warning(self, 'Convert to dataset',
+                                'Invalid export options in {}:\n{}'.format(PROJECT_CONFIG, e))
+            return
+        if self.projectConfig['scanLabels'] and options['labelNames'] is None:
+            # 只读取标注区域 不解码图像
+            QApplication.setOverrideCursor(Qt.WaitCursor)
+            try:
+                options['labelNames'] = scan_label_names(filename, self.projectConfig['workers'])
+            except (IOError, ValueError) as e:
+                QApplication.restoreOverrideCursor()
+                QMessageBox.warning(self, 'Convert to dataset', 'Scan labels failed:\n{}'.format(e))
+                return
+            QApplication.restoreOverrideCursor()
+
+        # 在进程池中转换 界面显示进度并允许取消
+        progress = QProgressDialog(
+            'Converting...', 'Cancel', 0, len(filename), self)
+        progress.setWindowTitle('Convert to dataset')
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+
+        success, skipped, ignored, errors = 0, 0, 0, []
+        results = iter_json_to_dataset(filename, self.projectConfig['workers'], options=options)
+        for result in results:
+            QApplication.processEvents()
+            if progress.wasCanceled():
+                results.close()
+                break
+            if result is None:
+                continue
+            if result[1] is not None:
+                errors.append(result[:2])
+            elif result[2] == NOT_LABEL_FILE:
+                ignored += 1
+            elif result[2]:
+                skipped += 1
+            else:
+                success += 1
+            progress.setValue(success + skipped + ignored + len(errors))
+            progress.setLabelText('Converting...\n{}'.format(
+                os.path.basename(result[0])))
+        progress.close()
+
+        mb = QMessageBox(self)
+        mb.setIcon(QMessageBox.Information if not errors else QMessageBox.Warning)
+        mb.setWindowTitle('Convert end')
+        mb.setText('Conversion {}.\n\n{} successed\n{} up to date\n{} not label files\n'
+                   '{} failed\n{} canceled'.format(
+                       'canceled' if progress.wasCanceled() else 'end', success, skipped,
+                       ignored, len(errors),
+                       len(filename) - success - skipped - ignored - len(errors)))
+        if errors:
+            # 每个失败文件的错误信息
+            mb.setDetailedText('\n'.join(
+                '{}\n    {}'.format(f, e) for f, e in errors))
+        mb.exec_()
@@ -0,0 +1,64 @@
+'''
+_JsonMemberReader 与 json.load 的对比测试
+
+使用很小的 CHUNK_SIZE 使数字、字符串及转义字符在各种位置被缓冲区截断
+'''
+import io
+import os
+import sys
+import json
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from tools import _JsonMemberReader  # noqa: E402
+
+
+def randomValue(rng, depth=0):
+    kind = rng.randrange(7 if depth < 2 else 5)
+    if kind == 0:
+        return rng.choice([0, -1, 7, -368658, 10 ** 12])
+    if kind == 1:
+        return rng.choice([-368658.25, 0.5, -1e-7, 3.25e10, 1.0])
+    if kind == 2:
+        return ''.join(rng.choice('ab"\\/\n中 ') for _ in range(rng.randrange(12)))
+    if kind == 3:
+        return rng.choice([True, False])
+    if kind == 4:
+        return None
+    if kind == 5:
+        return [randomValue(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {'k{}'.format(i): randomValue(rng, depth + 1) for i in range(rng.randrange(4))}
+
+
+def randomDocument(rng):
+    data = {'key{}'.format(i): randomValue(rng) for i in range(rng.randrange(1, 6))}
+    if rng.random() < 0.5:
+        data['imageData'] = ''.join(rng.choice('ab\\"') for _ in range(rng.randrange(40)))
+    return data
+
+
+def readMembers(text, chunkSize, skip=()):
+    reader = _JsonMemberReader(io.StringIO(text))
+    reader.CHUNK_SIZE = chunkSize
+    return dict(reader.members(skip))
+
+
+@pytest.mark.parametrize('chunkSize', [1, 2, 3, 5, 8, 13])
+def test_round_trip(chunkSize):
+    rng = random.Random(chunkSize)
+    for _ in range(300):
+        data = randomDocument(rng)
+        text = json.dumps(data, indent=rng.choice([None, 1]), ensure_ascii=rng.random() < 0.5)
+        expected = json.load(io.StringIO(text))
+        assert readMembers(text, chunkSize) == expected
+        expected.pop('imageData', None)
+        assert readMembers(text, chunkSize, skip=('imageData',)) == expected
+
+
+@pytest.mark.parametrize('text', ['{"a": 1 2}', '{"a": 1', '{"a" 1}', '[1, 2]'])
+def test_invalid(text):
+    with pytest.raises(ValueError):
+        readMembers(text, 2)